@@ -1,96 +1,85 @@
-from typing import List, Dict, Any, Optional
-import json
+from typing import AsyncIterator, List, Dict, Any, Optional
+import asyncio
 from datetime import datetime
-from sqlalchemy.orm import Session
-from openai import OpenAI
+import orjson
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import get_settings
-from app.database.models import User, Conversation, UserPreference, PropertyRecommendation
+from app.core.cache import (
+    redis_cached, invalidate,
+    HISTORY_CACHE_KEY, HISTORY_CACHE_TTL, PREFERENCES_CACHE_KEY, PREFERENCES_CACHE_TTL,
+    HISTORY_RESPONSE_CACHE_KEY, PREFERENCES_RESPONSE_CACHE_KEY
+)
+from app.core.llm import get_openai_client, get_llm_cache, ANALYSIS_CACHE_TTL
+from app.database.models import Conversation, UserPreference
+from app.database.crud import get_or_create_user_id
+from app.database.writer import conversation_writer
 from app.agents.preference_learner import PreferenceLearner
-from app.integrations.property_platforms import PropertyPlatformManager
+from app.integrations.property_platforms import PropertyPlatformManager, normalize_search_criteria
+
+
+# Preference types that feed into the property search criteria
+SEARCH_PREFERENCE_TYPES = ("location", "max_price", "min_bedrooms", "property_type")
 
 
 class REAgent:
     """
     The core REAgent - an autonomous AI real estate concierge that learns preferences
     and provides personalized property recommendations through natural conversation.
+    
+    One instance is shared by all requests, so it holds no per-request state;
+    the database session is passed to each call instead.
     """
     
-    def __init__(self, db: Session):
-        self.db = db
-        self.settings = get_settings()
-        self.openai_client = OpenAI(api_key=self.settings.openai_api_key)
-        self.preference_learner = PreferenceLearner(db)
-        self.property_manager = PropertyPlatformManager()
-        
-        # Agent personality and system prompt
-        self.system_prompt = """
-        You are REAgent, an intelligent and friendly AI real estate concierge. Your mission is to help users find their perfect home through natural conversation.
+    # Agent personality and system prompt. Kept identical across requests so the
+    # static prefix can be served from OpenAI's prompt cache; per-user context
+    # goes in a separate message after it.
+    SYSTEM_PROMPT = """
+    You are REAgent, an intelligent and friendly AI real estate concierge. Your mission is to help users find their perfect home through natural conversation.
 
-        Core capabilities:
-        - Learn user preferences dynamically from conversation
-        - Search and analyze real-time property listings
-        - Provide personalized recommendations with pros/cons
-        - Handle logistics like viewing arrangements
-        - Adapt and improve with each interaction
+    Core capabilities:
+    - Learn user preferences dynamically from conversation
+    - Search and analyze real-time property listings
+    - Provide personalized recommendations with pros/cons
+    - Handle logistics like viewing arrangements
+    - Adapt and improve with each interaction
 
-        Personality:
-        - Warm, helpful, and professional
-        - Proactive in asking clarifying questions
-        - Enthusiastic about helping find the perfect home
-        - Expert knowledge of UK property market
-        - Patient and understanding of changing needs
+    Personality:
+    - Warm, helpful, and professional
+    - Proactive in asking clarifying questions
+    - Enthusiastic about helping find the perfect home
+    - Expert knowledge of UK property market
+    - Patient and understanding of changing needs
 
-        Always:
-        - Ask follow-up questions to understand preferences better
-        - Explain your reasoning for recommendations
-        - Highlight both pros and cons of properties
-        - Offer to help with next steps (viewings, agent contact)
-        - Remember and reference previous conversation context
-        """
+    Always:
+    - Ask follow-up questions to understand preferences better
+    - Explain your reasoning for recommendations
+    - Highlight both pros and cons of properties
+    - Offer to help with next steps (viewings, agent contact)
+    - Remember and reference previous conversation context
+    """
+    
+    def __init__(self, property_manager: PropertyPlatformManager):
+        self.settings = get_settings()
+        self.openai_client = get_openai_client()
+        self.llm_cache = get_llm_cache()
+        self.preference_learner = PreferenceLearner()
+        self.property_manager = property_manager
 
-    async def process_message(self, user_id: int, message: str, session_id: str) -> Dict[str, Any]:
+    async def process_message(self, db: AsyncSession, message: str, session_id: str) -> Dict[str, Any]:
         """
         Process a user message and generate an intelligent response with recommendations.
         """
         try:
-            # Get or create user
-            user = self._get_or_create_user(session_id)
-            
-            # Store user message
-            self._store_conversation(user.id, message, "", "user")
-            
-            # Get conversation history
-            conversation_history = self._get_conversation_history(user.id)
-            
-            # Extract and update preferences from the message
-            extracted_prefs = await self.preference_learner.extract_preferences(message, user.id)
-            
-            # Get current user preferences
-            current_preferences = self._get_user_preferences(user.id)
-            
-            # Search for properties based on preferences
-            properties = await self._search_properties(current_preferences)
+            turn = await self._prepare_turn(db, message, session_id)
             
             # Generate AI response
             ai_response = await self._generate_response(
-                message, conversation_history, current_preferences, properties
+                message, turn["history"], turn["preferences"], turn["properties"]
             )
             
-            # Store AI response
-            self._store_conversation(user.id, message, ai_response["content"], "agent")
-            
-            # Generate property recommendations if any found
-            recommendations = []
-            if properties:
-                recommendations = await self._generate_recommendations(user.id, properties, current_preferences)
-            
-            return {
-                "response": ai_response["content"],
-                "recommendations": recommendations,
-                "extracted_preferences": extracted_prefs,
-                "conversation_id": user.id
-            }
+            return await self._finish_turn(turn, message, ai_response["content"])
             
         except Exception as e:
             error_response = "I apologize, but I encountered an issue processing your request. Could you please try again?"
@@ -101,53 +90,138 @@ class REAgent:
                 "error": str(e)
             }
 
-    def _get_or_create_user(self, session_id: str) -> User:
-        """Get existing user or create new one based on session ID"""
-        user = self.db.query(User).filter(User.session_id == session_id).first()
-        if not user:
-            user = User(session_id=session_id)
-            self.db.add(user)
-            self.db.commit()
-            self.db.refresh(user)
-        return user
+    async def stream_message(self, db: AsyncSession, message: str, session_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Process a user message like process_message, but stream the response as it is
+        generated. Yields {"type": "token"} events with response text, then a single
+        {"type": "done"} event carrying the full result, or {"type": "error"} on failure.
+        """
+        try:
+            turn = await self._prepare_turn(db, message, session_id)
+            
+            # Stream the AI response, keeping the full text for storage
+            chunks = []
+            async for content in self._stream_response(
+                message, turn["history"], turn["preferences"], turn["properties"]
+            ):
+                chunks.append(content)
+                yield {"type": "token", "content": content}
+            
+            result = await self._finish_turn(turn, message, "".join(chunks))
+            yield {"type": "done", **result}
+            
+        except Exception as e:
+            yield {
+                "type": "error",
+                "response": "I apologize, but I encountered an issue processing your request. Could you please try again?",
+                "error": str(e)
+            }
 
-    def _store_conversation(self, user_id: int, message: str, response: str, message_type: str):
-        """Store conversation in database"""
-        conversation = Conversation(
-            user_id=user_id,
-            message=message,
-            response=response,
-            message_type=message_type
+    async def _prepare_turn(self, db: AsyncSession, message: str, session_id: str) -> Dict[str, Any]:
+        """
+        Learn preferences from the message and gather everything needed to respond:
+        conversation history, current preferences and matching properties.
+        """
+        # Get or create user
+        user_id = await get_or_create_user_id(db, session_id)
+        
+        # Extract and update preferences from the message in the background
+        pref_task = asyncio.create_task(
+            self.preference_learner.extract_preferences(message, user_id)
         )
-        self.db.add(conversation)
-        self.db.commit()
+        
+        # Get conversation history
+        conversation_history = await self._get_conversation_history(db, user_id)
+        
+        # Search on the stored preferences while extraction is in flight
+        current_preferences = await self._get_user_preferences(db, user_id)
+        search_criteria = self._build_search_criteria(current_preferences)
+        search_task = asyncio.create_task(self._search_properties(search_criteria))
+        
+        extracted_prefs, properties = await asyncio.gather(pref_task, search_task)
+        
+        # Pick up the newly learned preferences; only search again if they
+        # changed the (normalized) criteria the first search was based on
+        current_preferences = await self._get_user_preferences(db, user_id)
+        new_criteria = self._build_search_criteria(current_preferences)
+        if normalize_search_criteria(new_criteria) != normalize_search_criteria(search_criteria):
+            properties = await self._search_properties(new_criteria)
+        
+        return {
+            "user_id": user_id,
+            "session_id": session_id,
+            "history": conversation_history,
+            "preferences": current_preferences,
+            "properties": properties,
+            "extracted_preferences": extracted_prefs
+        }
 
-    def _get_conversation_history(self, user_id: int) -> List[Dict[str, str]]:
+    async def _finish_turn(self, turn: Dict[str, Any], message: str, response: str) -> Dict[str, Any]:
+        """Store the exchange and found properties, and build recommendations for the response"""
+        user_id = turn["user_id"]
+        
+        # Store the exchange as a single row, along with the listings found so
+        # their details can be served from the database
+        await self._store_conversation(user_id, turn["session_id"], message, response, turn["properties"])
+        
+        # Preferences learned this turn are already committed
+        await invalidate(PREFERENCES_RESPONSE_CACHE_KEY.format(session_id=turn["session_id"]))
+        
+        # Generate property recommendations if any found
+        recommendations = []
+        if turn["properties"]:
+            recommendations = await self._generate_recommendations(
+                user_id, turn["properties"], turn["preferences"]
+            )
+        
+        return {
+            "response": response,
+            "recommendations": recommendations,
+            "extracted_preferences": turn["extracted_preferences"],
+            "conversation_id": user_id
+        }
+
+    async def _store_conversation(
+        self,
+        user_id: int,
+        session_id: str,
+        message: str,
+        response: str,
+        properties: List[Dict[str, Any]]
+    ):
+        """Queue the exchange, stored as a single row, and the found listings for the background writer"""
+        await conversation_writer.write(
+            [{"user_id": user_id, "message": message, "response": response, "message_type": "agent"}],
+            cache_keys=[HISTORY_RESPONSE_CACHE_KEY.format(session_id=session_id)],
+            listings=properties
+        )
+
+    @redis_cached(key=HISTORY_CACHE_KEY, ttl=HISTORY_CACHE_TTL)
+    async def _get_conversation_history(self, db: AsyncSession, user_id: int) -> List[Dict[str, str]]:
         """Get recent conversation history for context"""
-        conversations = (
-            self.db.query(Conversation)
-            .filter(Conversation.user_id == user_id)
-            .order_by(Conversation.created_at.desc())
+        # Each agent row holds a whole exchange; newest first from the
+        # (user_id, created_at) index
+        result = await db.execute(
+            select(Conversation.message, Conversation.response)
+            .where(Conversation.user_id == user_id, Conversation.message_type == "agent")
+            .order_by(Conversation.created_at.desc(), Conversation.id.desc())
             .limit(self.settings.max_conversation_history)
-            .all()
         )
         
         history = []
-        for conv in reversed(conversations):
-            if conv.message_type == "user":
-                history.append({"role": "user", "content": conv.message})
-            elif conv.message_type == "agent":
-                history.append({"role": "assistant", "content": conv.response})
+        for message, response in result.all()[::-1]:
+            history.append({"role": "user", "content": message})
+            history.append({"role": "assistant", "content": response})
         
         return history
 
-    def _get_user_preferences(self, user_id: int) -> Dict[str, Any]:
+    @redis_cached(key=PREFERENCES_CACHE_KEY, ttl=PREFERENCES_CACHE_TTL)
+    async def _get_user_preferences(self, db: AsyncSession, user_id: int) -> Dict[str, Any]:
         """Get current user preferences"""
-        preferences = (
-            self.db.query(UserPreference)
-            .filter(UserPreference.user_id == user_id)
-            .all()
+        result = await db.execute(
+            select(UserPreference).where(UserPreference.user_id == user_id)
         )
+        preferences = result.scalars().all()
         
         prefs_dict = {}
         for pref in preferences:
@@ -159,20 +233,20 @@ class REAgent:
         
         return prefs_dict
 
-    async def _search_properties(self, preferences: Dict[str, Any]) -> List[Dict[str, Any]]:
-        """Search for properties based on user preferences"""
+    def _build_search_criteria(self, preferences: Dict[str, Any]) -> Dict[str, Any]:
+        """Platform search criteria from the user's current preferences"""
+        return {
+            pref_type: preferences[pref_type]["value"]
+            for pref_type in SEARCH_PREFERENCE_TYPES
+            if pref_type in preferences
+        }
+
+    async def _search_properties(self, search_criteria: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Search for properties matching the given criteria"""
         try:
-            # Extract search criteria from preferences
-            search_criteria = {}
-            
-            if "location" in preferences:
-                search_criteria["location"] = preferences["location"]["value"]
-            if "max_price" in preferences:
-                search_criteria["max_price"] = preferences["max_price"]["value"]
-            if "min_bedrooms" in preferences:
-                search_criteria["min_bedrooms"] = preferences["min_bedrooms"]["value"]
-            if "property_type" in preferences:
-                search_criteria["property_type"] = preferences["property_type"]["value"]
+            # Too little to go on yet; don't hit the platforms for noise
+            if "location" not in search_criteria and "max_price" not in search_criteria:
+                return []
             
             # Search across platforms
             properties = await self.property_manager.search_properties(search_criteria)
@@ -182,21 +256,22 @@ class REAgent:
             print(f"Error searching properties: {e}")
             return []
 
-    async def _generate_response(
+    def _build_response_messages(
         self, 
         message: str, 
         history: List[Dict[str, str]], 
         preferences: Dict[str, Any],
         properties: List[Dict[str, Any]]
-    ) -> Dict[str, str]:
-        """Generate AI response using OpenAI"""
+    ) -> List[Dict[str, str]]:
+        """Build the chat messages for the user-facing response"""
         
         # Build context about user preferences
-        prefs_context = "Current user preferences:\n"
+        prefs_lines = ["Current user preferences:"]
         for pref_type, pref_data in preferences.items():
             confidence = pref_data["confidence"]
             explicit = "explicitly stated" if pref_data["is_explicit"] else "inferred"
-            prefs_context += f"- {pref_type}: {pref_data['value']} (confidence: {confidence:.2f}, {explicit})\n"
+            prefs_lines.append(f"- {pref_type}: {pref_data['value']} (confidence: {confidence:.2f}, {explicit})")
+        prefs_context = "\n".join(prefs_lines) + "\n"
         
         # Build context about found properties
         properties_context = ""
@@ -204,18 +279,32 @@ class REAgent:
             properties_context = f"\nFound {len(properties)} relevant properties. Consider mentioning the most suitable ones in your response."
         
         messages = [
-            {"role": "system", "content": self.system_prompt + "\n\n" + prefs_context + properties_context}
+            {"role": "system", "content": self.SYSTEM_PROMPT},
+            {"role": "system", "content": prefs_context + properties_context}
         ]
         
         # Add conversation history
-        messages.extend(history[-10:])  # Last 10 messages for context
+        # Add conversation history, two messages per exchange
+        messages.extend(history[-2 * self.settings.max_conversation_history:])
         
         # Add current message
         messages.append({"role": "user", "content": message})
         
+        return messages
+
+    async def _generate_response(
+        self, 
+        message: str, 
+        history: List[Dict[str, str]], 
+        preferences: Dict[str, Any],
+        properties: List[Dict[str, Any]]
+    ) -> Dict[str, str]:
+        """Generate AI response using OpenAI"""
+        messages = self._build_response_messages(message, history, preferences, properties)
+        
         try:
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4",
+            response = await self.openai_client.chat.completions.create(
+                model=self.settings.openai_chat_model,
                 messages=messages,
                 max_tokens=500,
                 temperature=0.7
@@ -226,6 +315,36 @@ class REAgent:
         except Exception as e:
             return {"content": "I apologize, but I'm having trouble generating a response right now. Please try again."}
 
+    async def _stream_response(
+        self, 
+        message: str, 
+        history: List[Dict[str, str]], 
+        preferences: Dict[str, Any],
+        properties: List[Dict[str, Any]]
+    ) -> AsyncIterator[str]:
+        """Stream the AI response from OpenAI as it is generated"""
+        messages = self._build_response_messages(message, history, preferences, properties)
+        
+        streamed = False
+        try:
+            stream = await self.openai_client.chat.completions.create(
+                model=self.settings.openai_chat_model,
+                messages=messages,
+                max_tokens=500,
+                temperature=0.7,
+                stream=True
+            )
+            
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    streamed = True
+                    yield chunk.choices[0].delta.content
+            
+        except Exception as e:
+            print(f"Error streaming response: {e}")
+            if not streamed:
+                yield "I apologize, but I'm having trouble generating a response right now. Please try again."
+
     async def _generate_recommendations(
         self, 
         user_id: int, 
@@ -233,42 +352,13 @@ class REAgent:
         preferences: Dict[str, Any]
     ) -> List[Dict[str, Any]]:
         """Generate property recommendations with AI analysis"""
-        recommendations = []
+        top_properties = properties[:5]  # Top 5 properties
+        analyses = await self._analyze_properties(top_properties, preferences)
         
-        for prop in properties[:5]:  # Top 5 properties
+        recommendations = []
+        for index, prop in enumerate(top_properties):
             try:
-                # Generate AI analysis for this property
-                analysis_prompt = f"""
-                Analyze this property for a user with these preferences:
-                {json.dumps(preferences, indent=2)}
-                
-                Property:
-                {json.dumps(prop, indent=2)}
-                
-                Provide:
-                1. Relevance score (0-1)
-                2. 3-5 specific pros based on user preferences
-                3. 3-5 specific cons or considerations
-                4. Brief reasoning for the recommendation
-                
-                Format as JSON:
-                {{
-                    "relevance_score": 0.85,
-                    "pros": ["specific pro 1", "specific pro 2"],
-                    "cons": ["specific con 1", "specific con 2"],
-                    "reasoning": "brief explanation"
-                }}
-                """
-                
-                response = self.openai_client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[{"role": "user", "content": analysis_prompt}],
-                    max_tokens=300,
-                    temperature=0.3
-                )
-                
-                analysis = json.loads(response.choices[0].message.content)
-                
+                analysis = analyses[index]
                 recommendations.append({
                     "property": prop,
                     "relevance_score": analysis["relevance_score"],
@@ -290,4 +380,90 @@ class REAgent:
         # Sort by relevance score
         recommendations.sort(key=lambda x: x["relevance_score"], reverse=True)
         
-        return recommendations 
\ No newline at end of file
+        return recommendations
+
+    async def _analyze_properties(
+        self,
+        properties: List[Dict[str, Any]],
+        preferences: Dict[str, Any]
+    ) -> Dict[int, Dict[str, Any]]:
+        """
+        Score a batch of properties against the user's preferences in a single
+        OpenAI call. Returns analyses keyed by property index; properties that
+        could not be analysed are missing from the result.
+        """
+        try:
+            # Only send the fields that matter for scoring
+            compact_properties = [
+                {
+                    "index": index,
+                    "title": prop.get("title"),
+                    "price": prop.get("price"),
+                    "bedrooms": prop.get("bedrooms"),
+                    "bathrooms": prop.get("bathrooms"),
+                    "type": prop.get("property_type"),
+                    "location": prop.get("location"),
+                    "features": prop.get("features"),
+                    "description": prop.get("description")
+                }
+                for index, prop in enumerate(properties)
+            ]
+            
+            analysis_prompt = f"""
+            Score these {len(properties)} properties for a user with the preferences below.
+            
+            Preferences:
+            {orjson.dumps(preferences).decode()}
+            
+            Properties:
+            {orjson.dumps(compact_properties).decode()}
+            
+            For each property provide:
+            1. Relevance score (0-1)
+            2. 3-5 specific pros based on user preferences
+            3. 3-5 specific cons or considerations
+            4. Brief reasoning for the recommendation
+            
+            Respond with a single JSON object containing one entry per property:
+            {{
+                "properties": [
+                    {{
+                        "index": 0,
+                        "relevance_score": 0.85,
+                        "pros": ["specific pro 1", "specific pro 2"],
+                        "cons": ["specific con 1", "specific con 2"],
+                        "reasoning": "brief explanation"
+                    }}
+                ]
+            }}
+            """
+            
+            messages = [{"role": "user", "content": analysis_prompt}]
+            model = self.settings.openai_structured_model
+            cache_key = self.llm_cache.make_key(model, 0.3, messages)
+            content = await self.llm_cache.get(cache_key)
+            cached = content is not None
+            
+            if not cached:
+                response = await self.openai_client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=300 * len(properties),
+                    temperature=0.3,
+                    response_format={"type": "json_object"}
+                )
+                content = response.choices[0].message.content
+            
+            analyses = {
+                analysis["index"]: analysis
+                for analysis in orjson.loads(content).get("properties", [])
+                if isinstance(analysis, dict) and "index" in analysis
+            }
+            if not cached:
+                await self.llm_cache.set(cache_key, content, ANALYSIS_CACHE_TTL)
+            
+            return analyses
+            
+        except Exception as e:
+            print(f"Error analysing properties: {e}")
+            return {}
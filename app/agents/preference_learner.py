@@ -1,23 +1,51 @@
 from typing import List, Dict, Any, Optional
+import asyncio
 import re
-import json
-from sqlalchemy.orm import Session
-from openai import OpenAI
+import orjson
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import get_settings
+from app.core.cache import invalidate, PREFERENCES_CACHE_KEY
+from app.core.llm import get_openai_client, get_llm_cache, EXTRACTION_CACHE_TTL
+from app.database.database import AsyncSessionLocal
 from app.database.models import UserPreference
 
 
+# Fallback extraction patterns, compiled once at import
+# "in", "around" or "near" followed by a place name, stopping before the next clause
+_LOCATION_RE = re.compile(
+    r'\b(?:in|around|near)\s+([a-z\s]+?)(?=\s+(?:under|below|with|for|max|budget|and|or)\b|[^a-z\s]|$)'
+)
+_PRICE_RES = [
+    re.compile(r'under £?(\d+(?:,\d{3})*(?:k)?)'),
+    re.compile(r'max.*?£?(\d+(?:,\d{3})*(?:k)?)'),
+    re.compile(r'budget.*?£?(\d+(?:,\d{3})*(?:k)?)')
+]
+# Also covers "bedroom"
+_BEDROOM_RE = re.compile(r'(\d+)\s*bed')
+# Single pass over the message for any known property type (singular or plural)
+_PROP_TYPE_RE = re.compile(r'\b(house|flat|apartment|studio|bungalow|cottage)s?\b')
+# Messages with numbers in them bypass the semantic extraction cache
+_DIGIT_RE = re.compile(r'\d')
+
+
 class PreferenceLearner:
     """
     Intelligent preference learning system that extracts user preferences from natural
     language conversation and updates them with confidence scoring.
     """
     
-    def __init__(self, db: Session):
-        self.db = db
+    # Short messages yielding at least this many pattern matches skip the LLM
+    FAST_PATH_MIN_PREFERENCES = 2
+    FAST_PATH_MAX_MESSAGE_LENGTH = 80
+    
+    def __init__(self):
+        # Holds no database session: one learner is shared by all requests, so
+        # extraction writes through its own session and reads take one per call
         self.settings = get_settings()
-        self.openai_client = OpenAI(api_key=self.settings.openai_api_key)
+        self.openai_client = get_openai_client()
+        self.llm_cache = get_llm_cache()
         
         # Preference extraction prompt
         self.extraction_prompt = """
@@ -48,7 +76,7 @@ class PreferenceLearner:
            - 0.4: weakly implied
            - 0.2: very uncertain inference
         
-        Return JSON format:
+        Respond with a single JSON object in this format:
         {
             "preferences": [
                 {
@@ -67,94 +95,182 @@ class PreferenceLearner:
     async def extract_preferences(self, message: str, user_id: int) -> List[Dict[str, Any]]:
         """
         Extract preferences from a user message and update the database.
+        
+        Cheap pattern matching runs first; the LLM is only consulted when the
+        message is long or the patterns found too little.
         """
+        pattern_preferences = self._fallback_extraction(message)
+        if (
+            len(pattern_preferences) >= self.FAST_PATH_MIN_PREFERENCES
+            and len(message) < self.FAST_PATH_MAX_MESSAGE_LENGTH
+        ):
+            await self._store_preferences(user_id, pattern_preferences)
+            return pattern_preferences
+        
         try:
-            # Use OpenAI to extract preferences
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": self.extraction_prompt},
-                    {"role": "user", "content": f"Extract preferences from: '{message}'"}
-                ],
-                max_tokens=500,
-                temperature=0.1  # Low temperature for consistent extraction
-            )
+            messages = [
+                {"role": "system", "content": self.extraction_prompt},
+                {"role": "user", "content": f"Extract preferences from: '{message}'"}
+            ]
             
-            # Parse the response
-            result = json.loads(response.choices[0].message.content)
-            extracted_preferences = result.get("preferences", [])
+            # Try an exact cache hit, then a semantically similar earlier message.
+            # Similar messages can differ in exactly the numbers extracted ("3 bed"
+            # vs "4 bed"), so messages containing digits skip the semantic tier
+            model = self.settings.openai_structured_model
+            cache_key = self.llm_cache.make_key(model, 0.1, messages)
+            embedding = None
+            content = await self.llm_cache.get(cache_key)
+            if content is None and not _DIGIT_RE.search(message):
+                embedding = await self.llm_cache.embed(message)
+                content = await self.llm_cache.get_similar(user_id, embedding)
+            cached = content is not None
             
-            # Update database with extracted preferences
-            for pref in extracted_preferences:
-                self._update_user_preference(
-                    user_id=user_id,
-                    preference_type=pref["type"],
-                    preference_value=pref["value"],
-                    confidence_score=pref["confidence"],
-                    is_explicit=pref["is_explicit"]
+            if not cached:
+                # Use OpenAI to extract preferences
+                response = await self.openai_client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=500,
+                    temperature=0.1,  # Low temperature for consistent extraction
+                    response_format={"type": "json_object"}
                 )
+                content = response.choices[0].message.content
             
-            return extracted_preferences
+            # Parse the response, keeping only well-formed entries
+            result = orjson.loads(content)
+            raw_preferences = result["preferences"]
+            llm_preferences = self._normalize_llm_preferences(raw_preferences)
+            
+            # Only cache responses whose entries were all valid, and cache the
+            # normalized form so a hit replays exactly what was stored
+            if not cached and len(llm_preferences) == len(raw_preferences):
+                normalized = orjson.dumps({"preferences": llm_preferences}).decode()
+                await asyncio.gather(
+                    self.llm_cache.set(cache_key, normalized, EXTRACTION_CACHE_TTL),
+                    self.llm_cache.set_similar(user_id, embedding, normalized, EXTRACTION_CACHE_TTL)
+                )
+            
+            # LLM results win; keep pattern matches for types it missed
+            llm_types = {pref["type"] for pref in llm_preferences}
+            extracted_preferences = llm_preferences + [
+                pref for pref in pattern_preferences if pref["type"] not in llm_types
+            ]
             
         except Exception as e:
             print(f"Error extracting preferences: {e}")
             # Fallback to simple keyword matching
-            return self._fallback_extraction(message, user_id)
+            extracted_preferences = pattern_preferences
+        
+        # Update database with extracted preferences
+        await self._store_preferences(user_id, extracted_preferences)
+        
+        return extracted_preferences
 
-    def _update_user_preference(
-        self, 
-        user_id: int, 
-        preference_type: str, 
-        preference_value: str,
-        confidence_score: float,
-        is_explicit: bool
-    ):
+    async def _store_preferences(self, user_id: int, preferences: List[Dict[str, Any]]):
         """
-        Update or create a user preference with intelligent merging.
+        Save extracted preferences. A failed write (e.g. a concurrent turn
+        inserting the same preference) is logged rather than failing the turn.
         """
-        # Check if preference already exists
-        existing_pref = (
-            self.db.query(UserPreference)
-            .filter(
+        try:
+            await self._update_user_preferences_bulk(user_id, preferences)
+        except Exception as e:
+            print(f"Error storing preferences: {e}")
+
+    @staticmethod
+    def _normalize_llm_preferences(entries: List[Any]) -> List[Dict[str, Any]]:
+        """
+        Validate preferences from the LLM. Entries need a type and value;
+        confidence defaults to 0.5 and is_explicit to False. Malformed
+        entries are dropped.
+        """
+        if not isinstance(entries, list):
+            raise ValueError(f"Expected a list of preferences, got {type(entries).__name__}")
+        
+        preferences = []
+        for entry in entries:
+            if not isinstance(entry, dict) or not entry.get("type") or entry.get("value") in (None, ""):
+                continue
+            try:
+                confidence = min(max(float(entry.get("confidence", 0.5)), 0.0), 1.0)
+            except (TypeError, ValueError):
+                confidence = 0.5
+            preferences.append({
+                "type": str(entry["type"]),
+                "value": str(entry["value"]),
+                "confidence": confidence,
+                "is_explicit": entry.get("is_explicit") is True,
+                "context": str(entry.get("context", ""))
+            })
+        
+        return preferences
+
+    async def _update_user_preferences_bulk(self, user_id: int, preferences: List[Dict[str, Any]]):
+        """
+        Update or create a batch of user preferences with intelligent merging,
+        using a single query to load existing rows and a single commit.
+        
+        Runs in its own session, as extraction overlaps with the agent's reads.
+        """
+        if not preferences:
+            return
+        
+        async with AsyncSessionLocal() as db:
+            await self._merge_user_preferences(db, user_id, preferences)
+            await db.commit()
+        
+        await invalidate(PREFERENCES_CACHE_KEY.format(user_id=user_id))
+
+    async def _merge_user_preferences(self, db: AsyncSession, user_id: int, preferences: List[Dict[str, Any]]):
+        """Merge a batch of preferences into the user's stored preferences"""
+        # Load all affected preferences in one query, keyed by type
+        preference_types = {pref["type"] for pref in preferences}
+        result = await db.execute(
+            select(UserPreference).where(
                 UserPreference.user_id == user_id,
-                UserPreference.preference_type == preference_type
+                UserPreference.preference_type.in_(preference_types)
             )
-            .first()
         )
+        existing_prefs = {pref.preference_type: pref for pref in result.scalars().all()}
         
-        if existing_pref:
-            # Intelligent merging logic
-            if confidence_score > existing_pref.confidence_score:
-                # New preference has higher confidence, replace
-                existing_pref.preference_value = preference_value
-                existing_pref.confidence_score = confidence_score
-                existing_pref.is_explicit = is_explicit
-            elif confidence_score == existing_pref.confidence_score and is_explicit:
-                # Same confidence but explicit, replace
-                existing_pref.preference_value = preference_value
-                existing_pref.is_explicit = is_explicit
+        for pref in preferences:
+            preference_type = pref["type"]
+            preference_value = pref["value"]
+            confidence_score = pref["confidence"]
+            is_explicit = pref["is_explicit"]
+            
+            existing_pref = existing_prefs.get(preference_type)
+            if existing_pref:
+                # Intelligent merging logic
+                if confidence_score > existing_pref.confidence_score:
+                    # New preference has higher confidence, replace
+                    existing_pref.preference_value = preference_value
+                    existing_pref.confidence_score = confidence_score
+                    existing_pref.is_explicit = is_explicit
+                elif confidence_score == existing_pref.confidence_score and is_explicit:
+                    # Same confidence but explicit, replace
+                    existing_pref.preference_value = preference_value
+                    existing_pref.is_explicit = is_explicit
+                else:
+                    # Keep existing preference but potentially merge values
+                    merged_value = self._merge_preference_values(
+                        existing_pref.preference_value, 
+                        preference_value,
+                        preference_type
+                    )
+                    if merged_value != existing_pref.preference_value:
+                        existing_pref.preference_value = merged_value
+                        existing_pref.confidence_score = max(existing_pref.confidence_score, confidence_score)
             else:
-                # Keep existing preference but potentially merge values
-                merged_value = self._merge_preference_values(
-                    existing_pref.preference_value, 
-                    preference_value,
-                    preference_type
+                # Create new preference
+                new_pref = UserPreference(
+                    user_id=user_id,
+                    preference_type=preference_type,
+                    preference_value=preference_value,
+                    confidence_score=confidence_score,
+                    is_explicit=is_explicit
                 )
-                if merged_value != existing_pref.preference_value:
-                    existing_pref.preference_value = merged_value
-                    existing_pref.confidence_score = max(existing_pref.confidence_score, confidence_score)
-        else:
-            # Create new preference
-            new_pref = UserPreference(
-                user_id=user_id,
-                preference_type=preference_type,
-                preference_value=preference_value,
-                confidence_score=confidence_score,
-                is_explicit=is_explicit
-            )
-            self.db.add(new_pref)
-        
-        self.db.commit()
+                db.add(new_pref)
+                existing_prefs[preference_type] = new_pref
 
     def _merge_preference_values(self, existing: str, new: str, pref_type: str) -> str:
         """
@@ -185,41 +301,30 @@ class PreferenceLearner:
             # Default: return new value
             return new
 
-    def _fallback_extraction(self, message: str, user_id: int) -> List[Dict[str, Any]]:
+    def _fallback_extraction(self, message: str) -> List[Dict[str, Any]]:
         """
         Fallback preference extraction using simple pattern matching.
+        Does not touch the database.
         """
         extracted = []
         message_lower = message.lower()
         
         # Location patterns
-        location_patterns = [
-            r'in ([a-zA-Z\s]+)',
-            r'around ([a-zA-Z\s]+)',
-            r'near ([a-zA-Z\s]+)'
-        ]
-        for pattern in location_patterns:
-            match = re.search(pattern, message_lower)
-            if match:
-                location = match.group(1).strip()
-                if len(location) > 2:
-                    extracted.append({
-                        "type": "location",
-                        "value": location.title(),
-                        "confidence": 0.6,
-                        "is_explicit": True,
-                        "context": f"Pattern match: {match.group(0)}"
-                    })
-                    break
+        match = _LOCATION_RE.search(message_lower)
+        if match:
+            location = match.group(1).strip()
+            if len(location) > 2:
+                extracted.append({
+                    "type": "location",
+                    "value": location.title(),
+                    "confidence": 0.6,
+                    "is_explicit": True,
+                    "context": f"Pattern match: {match.group(0)}"
+                })
         
         # Price patterns
-        price_patterns = [
-            r'under £?(\d+(?:,\d{3})*(?:k)?)',
-            r'max.*?£?(\d+(?:,\d{3})*(?:k)?)',
-            r'budget.*?£?(\d+(?:,\d{3})*(?:k)?)'
-        ]
-        for pattern in price_patterns:
-            match = re.search(pattern, message_lower)
+        for pattern in _PRICE_RES:
+            match = pattern.search(message_lower)
             if match:
                 price_str = match.group(1)
                 price = self._parse_price(price_str)
@@ -234,45 +339,27 @@ class PreferenceLearner:
                     break
         
         # Bedroom patterns
-        bedroom_patterns = [
-            r'(\d+)\s*bed',
-            r'(\d+)\s*bedroom'
-        ]
-        for pattern in bedroom_patterns:
-            match = re.search(pattern, message_lower)
-            if match:
-                bedrooms = match.group(1)
-                extracted.append({
-                    "type": "min_bedrooms",
-                    "value": bedrooms,
-                    "confidence": 0.8,
-                    "is_explicit": True,
-                    "context": f"Pattern match: {match.group(0)}"
-                })
-                break
+        match = _BEDROOM_RE.search(message_lower)
+        if match:
+            extracted.append({
+                "type": "min_bedrooms",
+                "value": match.group(1),
+                "confidence": 0.8,
+                "is_explicit": True,
+                "context": f"Pattern match: {match.group(0)}"
+            })
         
         # Property type patterns
-        property_types = ["house", "flat", "apartment", "studio", "bungalow", "cottage"]
-        for prop_type in property_types:
-            if prop_type in message_lower:
-                extracted.append({
-                    "type": "property_type",
-                    "value": prop_type,
-                    "confidence": 0.9,
-                    "is_explicit": True,
-                    "context": f"Direct mention of {prop_type}"
-                })
-                break
-        
-        # Update database with fallback extractions
-        for pref in extracted:
-            self._update_user_preference(
-                user_id=user_id,
-                preference_type=pref["type"],
-                preference_value=pref["value"],
-                confidence_score=pref["confidence"],
-                is_explicit=pref["is_explicit"]
-            )
+        match = _PROP_TYPE_RE.search(message_lower)
+        if match:
+            prop_type = match.group(1)
+            extracted.append({
+                "type": "property_type",
+                "value": prop_type,
+                "confidence": 0.9,
+                "is_explicit": True,
+                "context": f"Direct mention of {prop_type}"
+            })
         
         return extracted
 
@@ -287,16 +374,20 @@ class PreferenceLearner:
         except:
             return None
 
-    def get_user_preferences_summary(self, user_id: int) -> str:
+    async def get_user_preferences_summary(self, db: AsyncSession, user_id: int) -> str:
         """
         Generate a natural language summary of user preferences.
         """
-        preferences = (
-            self.db.query(UserPreference)
-            .filter(UserPreference.user_id == user_id)
-            .all()
+        result = await db.execute(
+            select(UserPreference).where(UserPreference.user_id == user_id)
         )
-        
+        return self.summarize_preferences(result.scalars().all())
+
+    @staticmethod
+    def summarize_preferences(preferences: List[UserPreference]) -> str:
+        """
+        Summarize already loaded preferences in natural language.
+        """
         if not preferences:
             return "No preferences learned yet."
         
@@ -1,15 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, delete, and_, or_
+from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
-import uuid
+from typing import List, Dict, Any, Optional, Literal
+import orjson
+import secrets
 
 from app.database.database import get_db
+from app.database.crud import get_user_id
+from app.database.models import User, Conversation, UserPreference, PropertyRecommendation
 from app.agents.core_agent import REAgent
+from app.api.dependencies import get_agent
+from app.core.cache import (
+    redis_cached, invalidate, session_cache_keys,
+    HISTORY_CACHE_KEY, PREFERENCES_CACHE_KEY, HISTORY_RESPONSE_CACHE_KEY, SESSION_RESPONSE_CACHE_TTL
+)
+from app.core.llm import get_llm_cache
 
 
 router = APIRouter()
 
+# Exchanges per page of conversation history
+HISTORY_PAGE_SIZE = 50
+
 
 class ChatMessage(BaseModel):
     message: str
@@ -27,202 +42,216 @@ class ChatResponse(BaseModel):
 class ConversationHistory(BaseModel):
     conversations: List[Dict[str, Any]]
     user_preferences: Dict[str, Any]
+    next_cursor: Optional[int] = None
+
+
+class FeedbackIn(BaseModel):
+    session_id: str
+    property_id: int
+    feedback: Literal["interested", "not_interested", "viewed"]
 
 
 @router.post("/message", response_model=ChatResponse)
 async def send_message(
     chat_message: ChatMessage,
-    request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    agent: REAgent = Depends(get_agent)
 ):
     """
     Send a message to REAgent and get an intelligent response with property recommendations.
     """
-    try:
-        # Generate session ID if not provided
-        session_id = chat_message.session_id or str(uuid.uuid4())
-        
-        # Initialize REAgent
-        agent = REAgent(db)
-        
-        # Process the message
-        result = await agent.process_message(
-            user_id=0,  # Will be determined by agent based on session_id
-            message=chat_message.message,
-            session_id=session_id
-        )
-        
-        return ChatResponse(
-            response=result["response"],
-            recommendations=result["recommendations"],
-            extracted_preferences=result["extracted_preferences"],
-            conversation_id=result["conversation_id"],
-            session_id=session_id
-        )
+    # Generate session ID if not provided
+    session_id = chat_message.session_id or secrets.token_urlsafe(16)
     
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error processing message: {str(e)}"
-        )
+    # Process the message
+    result = await agent.process_message(
+        db,
+        message=chat_message.message,
+        session_id=session_id
+    )
+    
+    return ChatResponse(
+        response=result["response"],
+        recommendations=result["recommendations"],
+        extracted_preferences=result["extracted_preferences"],
+        conversation_id=result["conversation_id"],
+        session_id=session_id
+    )
+
+
+@router.post("/message/stream")
+async def stream_message(
+    chat_message: ChatMessage,
+    db: AsyncSession = Depends(get_db),
+    agent: REAgent = Depends(get_agent)
+):
+    """
+    Send a message to REAgent and stream the response as server-sent events.
+    
+    Emits "token" events as the response is generated, followed by a "done" event
+    with recommendations, extracted preferences and the session ID.
+    """
+    # Generate session ID if not provided
+    session_id = chat_message.session_id or secrets.token_urlsafe(16)
+    
+    async def event_stream():
+        async for event in agent.stream_message(db, chat_message.message, session_id):
+            if event["type"] == "done":
+                event["session_id"] = session_id
+            yield b"data: " + orjson.dumps(event) + b"\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
 
 
 @router.get("/history/{session_id}", response_model=ConversationHistory)
 async def get_conversation_history(
     session_id: str,
-    db: Session = Depends(get_db)
+    before: Optional[int] = Query(None, description="Only return exchanges older than this conversation ID"),
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=200, description="Number of exchanges to return"),
+    db: AsyncSession = Depends(get_db)
 ):
     """
-    Get conversation history and learned preferences for a session.
+    Get conversation history and learned preferences for a session, a page at a
+    time starting from the newest. Pass `next_cursor` back as `before` to load
+    older exchanges.
     """
-    try:
-        from app.database.models import User, Conversation, UserPreference
-        
-        # Get user by session ID
-        user = db.query(User).filter(User.session_id == session_id).first()
-        
-        if not user:
-            return ConversationHistory(
-                conversations=[],
-                user_preferences={}
-            )
-        
-        # Get conversation history
-        conversations = (
-            db.query(Conversation)
-            .filter(Conversation.user_id == user.id)
-            .order_by(Conversation.created_at.desc())
-            .limit(50)
-            .all()
-        )
-        
-        # Format conversations
-        conversation_list = []
-        for conv in reversed(conversations):
-            conversation_list.append({
-                "id": conv.id,
-                "message": conv.message,
-                "response": conv.response,
-                "message_type": conv.message_type,
-                "created_at": conv.created_at.isoformat()
-            })
-        
-        # Get user preferences
-        preferences = (
-            db.query(UserPreference)
-            .filter(UserPreference.user_id == user.id)
-            .all()
-        )
-        
-        user_prefs = {}
-        for pref in preferences:
-            user_prefs[pref.preference_type] = {
-                "value": pref.preference_value,
-                "confidence": pref.confidence_score,
-                "is_explicit": pref.is_explicit,
-                "updated_at": pref.updated_at.isoformat() if pref.updated_at else None
-            }
-        
-        return ConversationHistory(
-            conversations=conversation_list,
-            user_preferences=user_prefs
-        )
+    if before is None and limit == HISTORY_PAGE_SIZE:
+        # The latest page is the one clients load, so only it is cached
+        history = await _load_conversation_history(session_id, db)
+    else:
+        history = await _load_conversation_page(session_id, db, before, limit)
     
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error retrieving conversation history: {str(e)}"
-        )
+    return ConversationHistory(**history)
+
+
+@redis_cached(key=HISTORY_RESPONSE_CACHE_KEY, ttl=SESSION_RESPONSE_CACHE_TTL)
+async def _load_conversation_history(session_id: str, db: AsyncSession) -> Dict[str, Any]:
+    """Load the latest history page for a session as plain data, so it can be cached"""
+    return await _load_conversation_page(session_id, db, None, HISTORY_PAGE_SIZE)
+
+
+async def _load_conversation_page(
+    session_id: str,
+    db: AsyncSession,
+    before: Optional[int],
+    limit: int
+) -> Dict[str, Any]:
+    """Load a page of the history response for a session"""
+    # Get conversation history by session, one row per exchange; an unknown
+    # session simply has none. Newest first, walking the (user_id, created_at)
+    # index from the cursor rather than an offset
+    query = (
+        select(Conversation)
+        .join(User)
+        .where(User.session_id == session_id, Conversation.message_type == "agent")
+        .order_by(Conversation.created_at.desc(), Conversation.id.desc())
+        .limit(limit)
+    )
+    if before is not None:
+        cursor = aliased(Conversation)
+        cursor_created_at = select(cursor.created_at).where(cursor.id == before).scalar_subquery()
+        query = query.where(or_(
+            Conversation.created_at < cursor_created_at,
+            and_(Conversation.created_at == cursor_created_at, Conversation.id < before)
+        ))
+    
+    result = await db.execute(query)
+    conversations = result.scalars().all()
+    
+    # A full page may have older exchanges behind it
+    next_cursor = conversations[-1].id if len(conversations) == limit else None
+    
+    # Format conversations, oldest first
+    conversation_list = [
+        {
+            "id": conv.id,
+            "message": conv.message,
+            "response": conv.response,
+            "message_type": conv.message_type,
+            "created_at": conv.created_at.isoformat()
+        }
+        for conv in conversations
+    ]
+    conversation_list.reverse()
+    
+    # Get user preferences
+    result = await db.execute(
+        select(UserPreference).join(User).where(User.session_id == session_id)
+    )
+    preferences = result.scalars().all()
+    
+    user_prefs = {}
+    for pref in preferences:
+        user_prefs[pref.preference_type] = {
+            "value": pref.preference_value,
+            "confidence": pref.confidence_score,
+            "is_explicit": pref.is_explicit,
+            "updated_at": pref.updated_at.isoformat() if pref.updated_at else None
+        }
+    
+    return {
+        "conversations": conversation_list,
+        "user_preferences": user_prefs,
+        "next_cursor": next_cursor
+    }
 
 
 @router.post("/feedback")
 async def provide_feedback(
-    request: Request,
-    db: Session = Depends(get_db)
+    feedback: FeedbackIn,
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Provide feedback on property recommendations to improve future suggestions.
     """
-    try:
-        data = await request.json()
-        
-        session_id = data.get("session_id")
-        property_id = data.get("property_id")
-        feedback = data.get("feedback")  # 'interested', 'not_interested', 'viewed'
-        
-        if not all([session_id, property_id, feedback]):
-            raise HTTPException(
-                status_code=400,
-                detail="session_id, property_id, and feedback are required"
-            )
-        
-        from app.database.models import User, PropertyRecommendation
-        
-        # Get user
-        user = db.query(User).filter(User.session_id == session_id).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User session not found")
-        
-        # Update recommendation feedback
-        recommendation = (
-            db.query(PropertyRecommendation)
-            .filter(
-                PropertyRecommendation.user_id == user.id,
-                PropertyRecommendation.property_id == property_id
-            )
-            .first()
-        )
-        
-        if recommendation:
-            recommendation.user_feedback = feedback
-            db.commit()
-        
-        # TODO: Use feedback to update preference learning model
-        
-        return {"status": "success", "message": "Feedback recorded"}
-    
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error processing feedback: {str(e)}"
+    # Get user
+    user_id = await get_user_id(db, feedback.session_id)
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User session not found")
+    
+    # Update recommendation feedback
+    result = await db.execute(
+        select(PropertyRecommendation).where(
+            PropertyRecommendation.user_id == user_id,
+            PropertyRecommendation.property_id == feedback.property_id
         )
+    )
+    recommendation = result.scalars().first()
+    
+    if recommendation:
+        recommendation.user_feedback = feedback.feedback
+        await db.commit()
+    
+    # TODO: Use feedback to update preference learning model
+    
+    return {"status": "success", "message": "Feedback recorded"}
 
 
 @router.delete("/session/{session_id}")
 async def clear_session(
     session_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Clear conversation history and preferences for a session.
     """
-    try:
-        from app.database.models import User, Conversation, UserPreference
-        
-        # Get user
-        user = db.query(User).filter(User.session_id == session_id).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User session not found")
-        
-        # Delete conversations
-        db.query(Conversation).filter(Conversation.user_id == user.id).delete()
-        
-        # Delete preferences
-        db.query(UserPreference).filter(UserPreference.user_id == user.id).delete()
-        
-        # Delete user
-        db.delete(user)
-        
-        db.commit()
-        
-        return {"status": "success", "message": "Session cleared"}
-    
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error clearing session: {str(e)}"
-        ) 
\ No newline at end of file
+    # Delete the user; their conversations, preferences and recommendations
+    # go with it through ON DELETE CASCADE
+    result = await db.execute(
+        delete(User).where(User.session_id == session_id).returning(User.id)
+    )
+    user_id = result.scalar_one_or_none()
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User session not found")
+    
+    await db.commit()
+    
+    # Forget cached reads and message embeddings for this user
+    await invalidate(
+        HISTORY_CACHE_KEY.format(user_id=user_id),
+        PREFERENCES_CACHE_KEY.format(user_id=user_id),
+        *session_cache_keys(session_id)
+    )
+    await get_llm_cache().invalidate_user(user_id)
+    
+    return {"status": "success", "message": "Session cleared"}
@@ -0,0 +1,14 @@
+from fastapi import Request
+
+from app.agents.core_agent import REAgent
+from app.integrations.property_platforms import PropertyPlatformManager
+
+
+def get_agent(request: Request) -> REAgent:
+    """Shared REAgent, created when the application starts"""
+    return request.app.state.agent
+
+
+def get_property_manager(request: Request) -> PropertyPlatformManager:
+    """Shared property platform manager, created when the application starts"""
+    return request.app.state.property_manager
@@ -1,13 +1,33 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select, delete, func, case
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
+from collections import Counter
 
-from app.database.database import get_db
+from app.database.database import get_db, upsert
+from app.database.crud import get_user_id, get_or_create_user_id
+from app.database.models import User, UserPreference
+from app.agents.core_agent import REAgent
+from app.agents.preference_learner import PreferenceLearner
+from app.api.dependencies import get_agent
+from app.core.cache import (
+    redis_cached, invalidate, session_cache_keys,
+    PREFERENCES_CACHE_KEY, PREFERENCES_RESPONSE_CACHE_KEY, SESSION_RESPONSE_CACHE_TTL
+)
 
 
 router = APIRouter()
 
+# Display category for each known preference type
+_PREFERENCE_CATEGORIES = {
+    **dict.fromkeys(['location', 'postcode', 'area'], "Location"),
+    **dict.fromkeys(['max_price', 'min_price', 'budget'], "Financial"),
+    **dict.fromkeys(['property_type', 'min_bedrooms', 'max_bedrooms', 'bathrooms'], "Property Specs"),
+    **dict.fromkeys(['garden', 'parking', 'balcony', 'specific_features'], "Features"),
+    **dict.fromkeys(['lifestyle', 'transport_links', 'schools', 'quiet', 'vibrant'], "Lifestyle"),
+}
+
 
 class PreferenceUpdate(BaseModel):
     preference_type: str
@@ -25,350 +45,261 @@ class UserPreferences(BaseModel):
 @router.get("/{session_id}", response_model=UserPreferences)
 async def get_user_preferences(
     session_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get all learned preferences for a user session.
     """
-    try:
-        from app.database.models import User, UserPreference
-        from app.agents.preference_learner import PreferenceLearner
-        
-        # Get user
-        user = db.query(User).filter(User.session_id == session_id).first()
-        if not user:
-            return UserPreferences(
-                session_id=session_id,
-                preferences={},
-                summary="No preferences learned yet."
-            )
-        
-        # Get preferences
-        preferences = (
-            db.query(UserPreference)
-            .filter(UserPreference.user_id == user.id)
-            .all()
-        )
-        
-        # Format preferences
-        prefs_dict = {}
-        for pref in preferences:
-            prefs_dict[pref.preference_type] = {
-                "value": pref.preference_value,
-                "confidence_score": pref.confidence_score,
-                "is_explicit": pref.is_explicit,
-                "created_at": pref.created_at.isoformat(),
-                "updated_at": pref.updated_at.isoformat() if pref.updated_at else None
-            }
-        
-        # Generate summary
-        preference_learner = PreferenceLearner(db)
-        summary = preference_learner.get_user_preferences_summary(user.id)
-        
-        return UserPreferences(
-            session_id=session_id,
-            preferences=prefs_dict,
-            summary=summary
-        )
+    return UserPreferences(**await _load_user_preferences(session_id, db))
+
+
+@redis_cached(key=PREFERENCES_RESPONSE_CACHE_KEY, ttl=SESSION_RESPONSE_CACHE_TTL)
+async def _load_user_preferences(session_id: str, db: AsyncSession) -> Dict[str, Any]:
+    """Load the preferences response for a session as plain data, so it can be cached"""
+    # Get preferences by session in one query; an unknown session has none
+    result = await db.execute(
+        select(UserPreference).join(User).where(User.session_id == session_id)
+    )
+    preferences = result.scalars().all()
     
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error retrieving preferences: {str(e)}"
-        )
+    # Format preferences
+    prefs_dict = {}
+    for pref in preferences:
+        prefs_dict[pref.preference_type] = {
+            "value": pref.preference_value,
+            "confidence_score": pref.confidence_score,
+            "is_explicit": pref.is_explicit,
+            "created_at": pref.created_at.isoformat(),
+            "updated_at": pref.updated_at.isoformat() if pref.updated_at else None
+        }
+    
+    # Generate summary
+    summary = PreferenceLearner.summarize_preferences(preferences)
+    
+    return {
+        "session_id": session_id,
+        "preferences": prefs_dict,
+        "summary": summary
+    }
 
 
 @router.post("/{session_id}/update")
 async def update_user_preference(
     session_id: str,
     preference_update: PreferenceUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Manually update a user preference.
     """
-    try:
-        from app.database.models import User, UserPreference
-        
-        # Get or create user
-        user = db.query(User).filter(User.session_id == session_id).first()
-        if not user:
-            user = User(session_id=session_id)
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-        
-        # Check if preference exists
-        existing_pref = (
-            db.query(UserPreference)
-            .filter(
-                UserPreference.user_id == user.id,
-                UserPreference.preference_type == preference_update.preference_type
-            )
-            .first()
-        )
-        
-        if existing_pref:
-            # Update existing preference
-            existing_pref.preference_value = preference_update.preference_value
-            existing_pref.confidence_score = preference_update.confidence_score
-            existing_pref.is_explicit = preference_update.is_explicit
-        else:
-            # Create new preference
-            new_pref = UserPreference(
-                user_id=user.id,
-                preference_type=preference_update.preference_type,
-                preference_value=preference_update.preference_value,
-                confidence_score=preference_update.confidence_score,
-                is_explicit=preference_update.is_explicit
-            )
-            db.add(new_pref)
-        
-        db.commit()
-        
-        return {
-            "status": "success",
-            "message": f"Preference '{preference_update.preference_type}' updated successfully",
-            "preference": {
-                "type": preference_update.preference_type,
-                "value": preference_update.preference_value,
-                "confidence_score": preference_update.confidence_score,
-                "is_explicit": preference_update.is_explicit
-            }
+    # Get or create user
+    user_id = await get_or_create_user_id(db, session_id)
+    
+    # Insert or overwrite the preference in one statement; relies on the
+    # unique (user_id, preference_type) index
+    stmt = upsert(UserPreference).values(
+        user_id=user_id,
+        preference_type=preference_update.preference_type,
+        preference_value=preference_update.preference_value,
+        confidence_score=preference_update.confidence_score,
+        is_explicit=preference_update.is_explicit
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserPreference.user_id, UserPreference.preference_type],
+        set_={
+            "preference_value": stmt.excluded.preference_value,
+            "confidence_score": stmt.excluded.confidence_score,
+            "is_explicit": stmt.excluded.is_explicit,
+            "updated_at": func.now()
         }
+    )
+    await db.execute(stmt)
     
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error updating preference: {str(e)}"
-        )
+    await db.commit()
+    await invalidate(PREFERENCES_CACHE_KEY.format(user_id=user_id), *session_cache_keys(session_id))
+    
+    return {
+        "status": "success",
+        "message": f"Preference '{preference_update.preference_type}' updated successfully",
+        "preference": {
+            "type": preference_update.preference_type,
+            "value": preference_update.preference_value,
+            "confidence_score": preference_update.confidence_score,
+            "is_explicit": preference_update.is_explicit
+        }
+    }
 
 
 @router.delete("/{session_id}/{preference_type}")
 async def delete_user_preference(
     session_id: str,
     preference_type: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Delete a specific user preference.
     """
-    try:
-        from app.database.models import User, UserPreference
-        
-        # Get user
-        user = db.query(User).filter(User.session_id == session_id).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User session not found")
-        
-        # Find and delete preference
-        preference = (
-            db.query(UserPreference)
-            .filter(
-                UserPreference.user_id == user.id,
-                UserPreference.preference_type == preference_type
-            )
-            .first()
+    # Find and delete the preference in one statement
+    user_id_query = select(User.id).where(User.session_id == session_id).scalar_subquery()
+    result = await db.execute(
+        delete(UserPreference)
+        .where(
+            UserPreference.user_id == user_id_query,
+            UserPreference.preference_type == preference_type
         )
-        
-        if not preference:
-            raise HTTPException(status_code=404, detail="Preference not found")
-        
-        db.delete(preference)
-        db.commit()
-        
-        return {
-            "status": "success",
-            "message": f"Preference '{preference_type}' deleted successfully"
-        }
+        .returning(UserPreference.user_id)
+    )
+    user_id = result.scalars().first()
     
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error deleting preference: {str(e)}"
-        )
+    if user_id is None:
+        # Only look the user up to report which one was missing
+        if await get_user_id(db, session_id) is None:
+            raise HTTPException(status_code=404, detail="User session not found")
+        raise HTTPException(status_code=404, detail="Preference not found")
+    
+    await db.commit()
+    await invalidate(PREFERENCES_CACHE_KEY.format(user_id=user_id), *session_cache_keys(session_id))
+    
+    return {
+        "status": "success",
+        "message": f"Preference '{preference_type}' deleted successfully"
+    }
 
 
 @router.delete("/{session_id}")
 async def clear_all_preferences(
     session_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Clear all preferences for a user session.
     """
-    try:
-        from app.database.models import User, UserPreference
-        
-        # Get user
-        user = db.query(User).filter(User.session_id == session_id).first()
-        if not user:
+    # Delete all preferences in one statement
+    user_id_query = select(User.id).where(User.session_id == session_id).scalar_subquery()
+    result = await db.execute(
+        delete(UserPreference)
+        .where(UserPreference.user_id == user_id_query)
+        .returning(UserPreference.user_id)
+    )
+    user_ids = result.scalars().all()
+    deleted_count = len(user_ids)
+    
+    if not user_ids:
+        # Nothing to clear; only look the user up to tell a missing session apart
+        if await get_user_id(db, session_id) is None:
             raise HTTPException(status_code=404, detail="User session not found")
-        
-        # Delete all preferences
-        deleted_count = (
-            db.query(UserPreference)
-            .filter(UserPreference.user_id == user.id)
-            .delete()
-        )
-        
-        db.commit()
-        
-        return {
-            "status": "success",
-            "message": f"Cleared {deleted_count} preferences successfully"
-        }
     
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error clearing preferences: {str(e)}"
-        )
+    await db.commit()
+    if user_ids:
+        await invalidate(PREFERENCES_CACHE_KEY.format(user_id=user_ids[0]), *session_cache_keys(session_id))
+    
+    return {
+        "status": "success",
+        "message": f"Cleared {deleted_count} preferences successfully"
+    }
 
 
 @router.post("/{session_id}/analyze")
 async def analyze_preferences_from_text(
     session_id: str,
     text_data: Dict[str, str],
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    agent: REAgent = Depends(get_agent)
 ):
     """
     Analyze text and extract preferences using AI.
     """
-    try:
-        from app.database.models import User
-        from app.agents.preference_learner import PreferenceLearner
-        
-        text = text_data.get("text", "")
-        if not text:
-            raise HTTPException(status_code=400, detail="Text is required")
-        
-        # Get or create user
-        user = db.query(User).filter(User.session_id == session_id).first()
-        if not user:
-            user = User(session_id=session_id)
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-        
-        # Extract preferences
-        preference_learner = PreferenceLearner(db)
-        extracted_preferences = await preference_learner.extract_preferences(text, user.id)
-        
-        return {
-            "status": "success",
-            "message": f"Extracted {len(extracted_preferences)} preferences",
-            "extracted_preferences": extracted_preferences
-        }
+    text = text_data.get("text", "")
+    if not text:
+        raise HTTPException(status_code=400, detail="Text is required")
     
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error analyzing preferences: {str(e)}"
-        )
+    # Get or create user
+    user_id = await get_or_create_user_id(db, session_id)
+    
+    # Extract preferences with the shared agent's learner
+    extracted_preferences = await agent.preference_learner.extract_preferences(text, user_id)
+    await invalidate(*session_cache_keys(session_id))
+    
+    return {
+        "status": "success",
+        "message": f"Extracted {len(extracted_preferences)} preferences",
+        "extracted_preferences": extracted_preferences
+    }
 
 
 @router.get("/{session_id}/insights")
 async def get_preference_insights(
     session_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get insights and analytics about user preferences.
     """
-    try:
-        from app.database.models import User, UserPreference
-        
-        # Get user
-        user = db.query(User).filter(User.session_id == session_id).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User session not found")
-        
-        # Get all preferences
-        preferences = (
-            db.query(UserPreference)
-            .filter(UserPreference.user_id == user.id)
-            .all()
+    # Aggregate the user's preferences in the database; a user without
+    # preferences still comes back as one row with a zero count
+    result = await db.execute(
+        select(
+            func.count(UserPreference.id),
+            func.sum(case((UserPreference.is_explicit.is_(True), 1), else_=0)),
+            func.sum(case((UserPreference.confidence_score >= 0.8, 1), else_=0)),
+            func.sum(case((UserPreference.confidence_score >= 0.5, 1), else_=0)),
+            func.avg(UserPreference.confidence_score)
         )
-        
-        if not preferences:
-            return {
-                "session_id": session_id,
-                "total_preferences": 0,
-                "insights": "No preferences to analyze yet."
-            }
-        
-        # Calculate insights
-        explicit_count = sum(1 for p in preferences if p.is_explicit)
-        implicit_count = len(preferences) - explicit_count
-        
-        high_confidence = sum(1 for p in preferences if p.confidence_score >= 0.8)
-        medium_confidence = sum(1 for p in preferences if 0.5 <= p.confidence_score < 0.8)
-        low_confidence = sum(1 for p in preferences if p.confidence_score < 0.5)
-        
-        avg_confidence = sum(p.confidence_score for p in preferences) / len(preferences)
-        
-        # Categorize preferences
-        categories = {}
-        for pref in preferences:
-            category = _categorize_preference(pref.preference_type)
-            if category not in categories:
-                categories[category] = 0
-            categories[category] += 1
-        
+        .select_from(User)
+        .outerjoin(UserPreference, UserPreference.user_id == User.id)
+        .where(User.session_id == session_id)
+        .group_by(User.id)
+    )
+    totals = result.first()
+    if totals is None:
+        raise HTTPException(status_code=404, detail="User session not found")
+    
+    total_count, explicit_count, high_confidence, medium_or_high, avg_confidence = totals
+    
+    if not total_count:
         return {
             "session_id": session_id,
-            "total_preferences": len(preferences),
-            "explicit_preferences": explicit_count,
-            "implicit_preferences": implicit_count,
-            "confidence_distribution": {
-                "high": high_confidence,
-                "medium": medium_confidence,
-                "low": low_confidence
-            },
-            "average_confidence": round(avg_confidence, 2),
-            "preference_categories": categories,
-            "insights": _generate_insights(preferences, avg_confidence, explicit_count, len(preferences))
+            "total_preferences": 0,
+            "insights": "No preferences to analyze yet."
         }
     
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error generating insights: {str(e)}"
-        )
+    implicit_count = total_count - explicit_count
+    medium_confidence = medium_or_high - high_confidence
+    low_confidence = total_count - medium_or_high
+    
+    # Count preferences per type, then fold the types into categories
+    result = await db.execute(
+        select(UserPreference.preference_type, func.count())
+        .join(User)
+        .where(User.session_id == session_id)
+        .group_by(UserPreference.preference_type)
+    )
+    categories = Counter()
+    for preference_type, count in result.all():
+        categories[_categorize_preference(preference_type)] += count
+    
+    return {
+        "session_id": session_id,
+        "total_preferences": total_count,
+        "explicit_preferences": explicit_count,
+        "implicit_preferences": implicit_count,
+        "confidence_distribution": {
+            "high": high_confidence,
+            "medium": medium_confidence,
+            "low": low_confidence
+        },
+        "average_confidence": round(avg_confidence, 2),
+        "preference_categories": dict(categories),
+        "insights": _generate_insights(avg_confidence, explicit_count, total_count)
+    }
 
 
 def _categorize_preference(preference_type: str) -> str:
     """Categorize preference types"""
-    location_types = ['location', 'postcode', 'area']
-    financial_types = ['max_price', 'min_price', 'budget']
-    property_types = ['property_type', 'min_bedrooms', 'max_bedrooms', 'bathrooms']
-    feature_types = ['garden', 'parking', 'balcony', 'specific_features']
-    lifestyle_types = ['lifestyle', 'transport_links', 'schools', 'quiet', 'vibrant']
-    
-    if preference_type in location_types:
-        return "Location"
-    elif preference_type in financial_types:
-        return "Financial"
-    elif preference_type in property_types:
-        return "Property Specs"
-    elif preference_type in feature_types:
-        return "Features"
-    elif preference_type in lifestyle_types:
-        return "Lifestyle"
-    else:
-        return "Other"
+    return _PREFERENCE_CATEGORIES.get(preference_type, "Other")
 
 
-def _generate_insights(preferences, avg_confidence, explicit_count, total_count) -> str:
+def _generate_insights(avg_confidence, explicit_count, total_count) -> str:
     """Generate textual insights about preferences"""
     insights = []
     
@@ -394,4 +325,4 @@ def _generate_insights(preferences, avg_confidence, explicit_count, total_count)
     else:
         insights.append("Continue chatting to help REAgent learn more about your preferences.")
     
-    return " ".join(insights) 
\ No newline at end of file
+    return " ".join(insights) 
@@ -1,10 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload, raiseload
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Dict, Any, Optional
+from datetime import datetime
 
-from app.database.database import get_db
+from app.database.database import get_db, upsert
+from app.database.crud import get_user_id
+from app.database.models import Property, PropertyRecommendation
 from app.integrations.property_platforms import PropertyPlatformManager
+from app.api.dependencies import get_property_manager
 
 
 router = APIRouter()
@@ -20,44 +26,98 @@ class PropertySearchCriteria(BaseModel):
     features: Optional[List[str]] = None
 
 
+class PropertySaveIn(BaseModel):
+    # Required: the duplicate check relies on the unique (external_id, platform)
+    # index, and SQL treats NULL IDs as distinct, so they would never conflict
+    external_id: str = Field(min_length=1)
+    platform: str = Field(max_length=16)
+    title: str
+    description: Optional[str] = None
+    price: Optional[int] = None
+    bedrooms: Optional[int] = None
+    bathrooms: Optional[int] = None
+    property_type: Optional[str] = Field(None, max_length=32)
+    location: str
+    postcode: Optional[str] = Field(None, max_length=8)
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    images: Optional[List[Any]] = None
+    features: Optional[List[Any]] = None
+    agent_info: Optional[Dict[str, Any]] = None
+    url: Optional[str] = None
+
+
 class PropertyResponse(BaseModel):
     properties: List[Dict[str, Any]]
     total_count: int
     search_criteria: Dict[str, Any]
 
 
+class PropertySummary(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    
+    id: int
+    external_id: Optional[str] = None
+    platform: str
+    title: str
+    description: Optional[str] = None
+    price: Optional[int] = None
+    bedrooms: Optional[int] = None
+    bathrooms: Optional[int] = None
+    property_type: Optional[str] = None
+    location: str
+    images: Optional[List[Any]] = None
+    features: Optional[List[Any]] = None
+    url: Optional[str] = None
+
+
+class PropertyDetails(PropertySummary):
+    postcode: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    agent_info: Optional[Dict[str, Any]] = None
+    created_at: Optional[datetime] = None
+
+
+class RecommendationOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    
+    recommendation_id: int = Field(validation_alias="id")
+    relevance_score: float
+    reasoning: Optional[str] = None
+    pros: Optional[List[Any]] = None
+    cons: Optional[List[Any]] = None
+    viewed: Optional[bool] = None
+    user_feedback: Optional[str] = None
+    property: PropertySummary
+
+
+class RecommendationList(BaseModel):
+    recommendations: List[RecommendationOut]
+    total_count: int
+    session_id: str
+
+
 @router.post("/search", response_model=PropertyResponse)
 async def search_properties(
     criteria: PropertySearchCriteria,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    property_manager: PropertyPlatformManager = Depends(get_property_manager)
 ):
     """
     Search for properties across multiple platforms based on criteria.
     """
-    try:
-        # Convert criteria to dict
-        search_criteria = {
-            k: v for k, v in criteria.dict().items() 
-            if v is not None
-        }
-        
-        # Initialize property platform manager
-        property_manager = PropertyPlatformManager()
-        
-        # Search properties
-        properties = await property_manager.search_properties(search_criteria)
-        
-        return PropertyResponse(
-            properties=properties,
-            total_count=len(properties),
-            search_criteria=search_criteria
-        )
+    # Convert criteria to dict, leaving out unset fields
+    search_criteria = criteria.model_dump(exclude_none=True)
     
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error searching properties: {str(e)}"
-        )
+    # Search properties
+    properties = await property_manager.search_properties(search_criteria)
+    
+    return PropertyResponse(
+        properties=properties,
+        total_count=len(properties),
+        search_criteria=search_criteria
+    )
 
 
 @router.get("/", response_model=PropertyResponse)
@@ -68,7 +128,8 @@ async def get_properties(
     min_bedrooms: Optional[int] = Query(None, description="Minimum bedrooms"),
     max_bedrooms: Optional[int] = Query(None, description="Maximum bedrooms"),
     property_type: Optional[str] = Query(None, description="Property type"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    property_manager: PropertyPlatformManager = Depends(get_property_manager)
 ):
     """
     Get properties using query parameters.
@@ -82,181 +143,111 @@ async def get_properties(
         property_type=property_type
     )
     
-    return await search_properties(criteria, db)
+    return await search_properties(criteria, db, property_manager)
 
 
-@router.get("/{property_id}")
+@router.get("/{property_id}", response_model=PropertyDetails)
 async def get_property_details(
     property_id: str,
     platform: str = Query(..., description="Platform: zoopla or rightmove"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get detailed information about a specific property.
     """
-    try:
-        from app.database.models import Property
-        
-        # First check if property exists in our database
-        property_obj = (
-            db.query(Property)
-            .filter(
-                Property.external_id == property_id,
-                Property.platform == platform
-            )
-            .first()
-        )
-        
-        if property_obj:
-            return {
-                "id": property_obj.id,
-                "external_id": property_obj.external_id,
-                "platform": property_obj.platform,
-                "title": property_obj.title,
-                "description": property_obj.description,
-                "price": property_obj.price,
-                "bedrooms": property_obj.bedrooms,
-                "bathrooms": property_obj.bathrooms,
-                "property_type": property_obj.property_type,
-                "location": property_obj.location,
-                "postcode": property_obj.postcode,
-                "latitude": property_obj.latitude,
-                "longitude": property_obj.longitude,
-                "images": property_obj.images,
-                "features": property_obj.features,
-                "agent_info": property_obj.agent_info,
-                "url": property_obj.url,
-                "created_at": property_obj.created_at.isoformat()
-            }
-        
-        # If not in database, could fetch from platform APIs
-        # For now, return not found
-        raise HTTPException(
-            status_code=404,
-            detail="Property not found"
+    # First check if property exists in our database
+    result = await db.execute(
+        select(Property).where(
+            Property.external_id == property_id,
+            Property.platform == platform
         )
+    )
+    property_obj = result.scalars().first()
     
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error retrieving property details: {str(e)}"
-        )
+    if property_obj:
+        return PropertyDetails.model_validate(property_obj)
+    
+    # If not in database, could fetch from platform APIs
+    # For now, return not found
+    raise HTTPException(
+        status_code=404,
+        detail="Property not found"
+    )
 
 
-@router.get("/recommendations/{session_id}")
+@router.get("/recommendations/{session_id}", response_model=RecommendationList)
 async def get_property_recommendations(
     session_id: str,
     limit: int = Query(10, description="Number of recommendations to return"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get personalized property recommendations for a user session.
     """
-    try:
-        from app.database.models import User, PropertyRecommendation, Property
-        from app.agents.core_agent import REAgent
-        
-        # Get user
-        user = db.query(User).filter(User.session_id == session_id).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User session not found")
-        
-        # Get existing recommendations
-        recommendations = (
-            db.query(PropertyRecommendation)
-            .join(Property)
-            .filter(PropertyRecommendation.user_id == user.id)
-            .order_by(PropertyRecommendation.relevance_score.desc())
-            .limit(limit)
-            .all()
-        )
-        
-        result = []
-        for rec in recommendations:
-            result.append({
-                "recommendation_id": rec.id,
-                "relevance_score": rec.relevance_score,
-                "reasoning": rec.reasoning,
-                "pros": rec.pros,
-                "cons": rec.cons,
-                "viewed": rec.viewed,
-                "user_feedback": rec.user_feedback,
-                "property": {
-                    "id": rec.property.id,
-                    "external_id": rec.property.external_id,
-                    "platform": rec.property.platform,
-                    "title": rec.property.title,
-                    "description": rec.property.description,
-                    "price": rec.property.price,
-                    "bedrooms": rec.property.bedrooms,
-                    "bathrooms": rec.property.bathrooms,
-                    "property_type": rec.property.property_type,
-                    "location": rec.property.location,
-                    "images": rec.property.images,
-                    "features": rec.property.features,
-                    "url": rec.property.url
-                }
-            })
-        
-        return {
-            "recommendations": result,
-            "total_count": len(result),
-            "session_id": session_id
-        }
+    # Get user
+    user_id = await get_user_id(db, session_id)
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User session not found")
     
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error retrieving recommendations: {str(e)}"
-        )
+    # Get existing recommendations; properties load in one batched query and
+    # any other relationship access raises instead of lazy loading
+    result = await db.execute(
+        select(PropertyRecommendation)
+        .options(selectinload(PropertyRecommendation.property), raiseload("*"))
+        .where(PropertyRecommendation.user_id == user_id)
+        .order_by(PropertyRecommendation.relevance_score.desc())
+        .limit(limit)
+    )
+    recommendations = result.scalars().all()
+    
+    # Skip recommendations whose property has since been removed
+    result = [
+        RecommendationOut.model_validate(rec)
+        for rec in recommendations
+        if rec.property is not None
+    ]
+    
+    return RecommendationList(
+        recommendations=result,
+        total_count=len(result),
+        session_id=session_id
+    )
 
 
 @router.post("/save")
 async def save_property(
-    request_data: Dict[str, Any],
-    db: Session = Depends(get_db)
+    property_in: PropertySaveIn,
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Save a property to the database for future reference.
     """
-    try:
-        from app.database.models import Property
-        
-        # Check if property already exists
-        existing_property = (
-            db.query(Property)
-            .filter(
-                Property.external_id == request_data.get("external_id"),
-                Property.platform == request_data.get("platform")
+    # Insert unless the (external_id, platform) pair is already saved
+    result = await db.execute(
+        upsert(Property)
+        .values(**property_in.model_dump(exclude_unset=True))
+        .on_conflict_do_nothing(index_elements=[Property.external_id, Property.platform])
+        .returning(Property.id)
+    )
+    property_id = result.scalar_one_or_none()
+    
+    if property_id is None:
+        result = await db.execute(
+            select(Property.id).where(
+                Property.external_id == property_in.external_id,
+                Property.platform == property_in.platform
             )
-            .first()
         )
-        
-        if existing_property:
-            return {
-                "status": "exists",
-                "property_id": existing_property.id,
-                "message": "Property already saved"
-            }
-        
-        # Create new property
-        property_obj = Property(**request_data)
-        db.add(property_obj)
-        db.commit()
-        db.refresh(property_obj)
-        
         return {
-            "status": "saved",
-            "property_id": property_obj.id,
-            "message": "Property saved successfully"
+            "status": "exists",
+            "property_id": result.scalar_one(),
+            "message": "Property already saved"
         }
     
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error saving property: {str(e)}"
-        ) 
\ No newline at end of file
+    await db.commit()
+    
+    return {
+        "status": "saved",
+        "property_id": property_id,
+        "message": "Property saved successfully"
+    }
@@ -0,0 +1,94 @@
+from functools import lru_cache, wraps
+from typing import Callable, List, Optional, Union
+import inspect
+import msgpack
+import redis.asyncio as redis
+
+from app.core.config import get_settings
+
+
+# Keys and lifetimes for cached per-user reads
+PREFERENCES_CACHE_KEY = "prefs:{user_id}"
+PREFERENCES_CACHE_TTL = 600
+HISTORY_CACHE_KEY = "conv:{user_id}"
+HISTORY_CACHE_TTL = 600
+
+# Keys and lifetime for cached per-session API responses
+HISTORY_RESPONSE_CACHE_KEY = "history:{session_id}"
+PREFERENCES_RESPONSE_CACHE_KEY = "preferences:{session_id}"
+SESSION_RESPONSE_CACHE_TTL = 60
+
+
+@lru_cache(maxsize=1)
+def get_redis() -> Optional[redis.Redis]:
+    """
+    Shared Redis client, or None when no REDIS_URL is configured so that
+    caching is simply skipped.
+    """
+    settings = get_settings()
+    if not settings.redis_url:
+        return None
+    return redis.Redis.from_url(settings.redis_url)
+
+
+def redis_cached(key: Union[str, Callable[..., str]], ttl: int, cache_empty: bool = True):
+    """
+    Cache an async function's result in Redis, serialized with msgpack.
+    
+    `key` is a format string filled from the call's arguments by name,
+    e.g. "prefs:{user_id}", or a function called with those arguments.
+    Empty results are not stored when `cache_empty` is False. Calls go
+    straight through when Redis is not configured or unavailable.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            redis_client = get_redis()
+            if redis_client is None:
+                return await func(*args, **kwargs)
+            
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            cache_key = key(**bound.arguments) if callable(key) else key.format(**bound.arguments)
+            
+            try:
+                cached = await redis_client.get(cache_key)
+                if cached is not None:
+                    return msgpack.unpackb(cached)
+            except Exception as e:
+                print(f"Cache read error for {cache_key}: {e}")
+            
+            result = await func(*args, **kwargs)
+            if not result and not cache_empty:
+                return result
+            
+            try:
+                await redis_client.setex(cache_key, ttl, msgpack.packb(result))
+            except Exception as e:
+                print(f"Cache write error for {cache_key}: {e}")
+            
+            return result
+        
+        return wrapper
+    return decorator
+
+
+def session_cache_keys(session_id: str) -> List[str]:
+    """Keys of every cached API response for a session"""
+    return [
+        HISTORY_RESPONSE_CACHE_KEY.format(session_id=session_id),
+        PREFERENCES_RESPONSE_CACHE_KEY.format(session_id=session_id)
+    ]
+
+
+async def invalidate(*keys: str):
+    """Delete cached entries; a no-op when Redis is not configured"""
+    redis_client = get_redis()
+    if redis_client is None or not keys:
+        return
+    try:
+        await redis_client.delete(*keys)
+    except Exception as e:
+        print(f"Cache invalidation error: {e}")
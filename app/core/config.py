@@ -1,4 +1,5 @@
 from pydantic_settings import BaseSettings
+from functools import lru_cache
 from typing import Optional
 import os
 
@@ -13,6 +14,16 @@ class Settings(BaseSettings):
     # Database
     database_url: str = "sqlite:///./reagent.db"
     
+    # Connection pool (server databases only; SQLite uses its own pooling)
+    db_pool_size: int = 20
+    db_max_overflow: int = 10
+    db_pool_timeout: int = 30
+    db_pool_recycle: int = 3600
+    db_pool_pre_ping: bool = True
+    
+    # Cache (leave empty to disable Redis caching)
+    redis_url: str = ""
+    
     # Security
     secret_key: str = "your-secret-key-change-in-production"
     algorithm: str = "HS256"
@@ -22,13 +33,30 @@ class Settings(BaseSettings):
     environment: str = "development"
     log_level: str = "INFO"
     
+    # Property Platforms
+    rightmove_search_pages: int = 1  # result pages fetched concurrently per search
+    rightmove_max_concurrent_requests: int = 4
+    
     # Agent Configuration
-    max_conversation_history: int = 50
+    max_conversation_history: int = 5  # past exchanges (message and reply) sent as context
     preference_learning_threshold: float = 0.7
     
+    # OpenAI Client
+    openai_chat_model: str = "gpt-4"  # user-facing replies
+    openai_structured_model: str = "gpt-4o-mini"  # JSON extraction and analysis
+    openai_timeout: float = 30.0
+    openai_max_retries: int = 2
+    openai_max_connections: int = 100
+    semantic_cache_threshold: float = 0.95
+    
     class Config:
         env_file = ".env"
 
 
+@lru_cache(maxsize=1)
 def get_settings() -> Settings:
+    """
+    Application settings, read from the environment and .env once per process.
+    Call get_settings.cache_clear() after changing the environment (e.g. in tests).
+    """
     return Settings() 
\ No newline at end of file
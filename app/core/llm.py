@@ -0,0 +1,161 @@
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import math
+import orjson
+import httpx
+from openai import AsyncOpenAI
+
+from app.core.config import get_settings
+from app.core.cache import get_redis
+
+
+# Cache lifetimes for LLM responses
+EXTRACTION_CACHE_TTL = 24 * 60 * 60
+ANALYSIS_CACHE_TTL = 60 * 60
+
+# Number of recent messages kept per user for semantic lookups
+SEMANTIC_CACHE_SIZE = 50
+
+
+@lru_cache(maxsize=1)
+def get_openai_client() -> AsyncOpenAI:
+    """
+    Shared async OpenAI client so the underlying HTTP connection pool is
+    reused across requests instead of being rebuilt per agent instance.
+    """
+    settings = get_settings()
+    return AsyncOpenAI(
+        api_key=settings.openai_api_key,
+        timeout=settings.openai_timeout,
+        max_retries=settings.openai_max_retries,
+        http_client=httpx.AsyncClient(
+            timeout=settings.openai_timeout,
+            limits=httpx.Limits(
+                max_connections=settings.openai_max_connections,
+                max_keepalive_connections=settings.openai_max_connections
+            )
+        )
+    )
+
+
+class AsyncLLMCache:
+    """
+    Redis cache for chat completion results. Exact hits are keyed on the full
+    request; semantic hits compare message embeddings per user. All methods
+    are no-ops when Redis is not configured, and cache errors never propagate.
+    """
+    
+    def __init__(self):
+        self.settings = get_settings()
+        self.redis = get_redis()
+        self.openai_client = get_openai_client()
+    
+    @staticmethod
+    def make_key(model: str, temperature: float, messages: List[Dict[str, str]]) -> str:
+        """Build the exact-match cache key for a completion request"""
+        payload = f"{model}|{temperature}|".encode() + orjson.dumps(messages, option=orjson.OPT_SORT_KEYS)
+        return "llm:" + hashlib.sha256(payload).hexdigest()
+    
+    async def get(self, key: str) -> Optional[str]:
+        """Return the cached completion content for a key"""
+        if self.redis is None:
+            return None
+        try:
+            content = await self.redis.get(key)
+            return content.decode() if content is not None else None
+        except Exception as e:
+            print(f"LLM cache read error: {e}")
+            return None
+    
+    async def set(self, key: str, content: str, ttl: int):
+        """Cache completion content under a key"""
+        if self.redis is None:
+            return
+        try:
+            await self.redis.setex(key, ttl, content)
+        except Exception as e:
+            print(f"LLM cache write error: {e}")
+    
+    async def embed(self, text: str) -> Optional[List[float]]:
+        """Embed a message for semantic lookups, or None when caching is unavailable"""
+        if self.redis is None:
+            return None
+        try:
+            response = await self.openai_client.embeddings.create(
+                model="text-embedding-3-small",
+                input=text
+            )
+            return response.data[0].embedding
+        except Exception as e:
+            print(f"LLM cache embedding error: {e}")
+            return None
+    
+    async def get_similar(self, user_id: int, embedding: Optional[List[float]]) -> Optional[str]:
+        """Return cached content for a semantically similar earlier message from this user"""
+        if self.redis is None or embedding is None:
+            return None
+        try:
+            entries = await self.redis.lrange(self._embedding_key(user_id), 0, -1)
+            
+            # Comparing against up to SEMANTIC_CACHE_SIZE long vectors is CPU
+            # work, so keep it off the event loop
+            best_score, best_content = await asyncio.to_thread(_best_match, embedding, entries)
+            
+            if best_score >= self.settings.semantic_cache_threshold:
+                return best_content
+            return None
+        except Exception as e:
+            print(f"LLM semantic cache read error: {e}")
+            return None
+    
+    async def set_similar(self, user_id: int, embedding: Optional[List[float]], content: str, ttl: int):
+        """Remember the content for a message so similar messages can reuse it"""
+        if self.redis is None or embedding is None:
+            return
+        try:
+            key = self._embedding_key(user_id)
+            entry = orjson.dumps({"embedding": embedding, "content": content})
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.lpush(key, entry)
+                pipe.ltrim(key, 0, SEMANTIC_CACHE_SIZE - 1)
+                pipe.expire(key, ttl)
+                await pipe.execute()
+        except Exception as e:
+            print(f"LLM semantic cache write error: {e}")
+    
+    async def invalidate_user(self, user_id: int):
+        """Drop the semantic cache entries stored for a user"""
+        if self.redis is None:
+            return
+        try:
+            await self.redis.delete(self._embedding_key(user_id))
+        except Exception as e:
+            print(f"LLM cache invalidation error: {e}")
+    
+    @staticmethod
+    def _embedding_key(user_id: int) -> str:
+        return f"emb:{user_id}"
+
+
+@lru_cache(maxsize=1)
+def get_llm_cache() -> AsyncLLMCache:
+    return AsyncLLMCache()
+
+
+def _best_match(embedding: List[float], entries: List[bytes]) -> Tuple[float, Optional[str]]:
+    """Highest cosine similarity among cached entries, with that entry's content"""
+    best_score, best_content = 0.0, None
+    for raw in entries:
+        entry = orjson.loads(raw)
+        score = _cosine_similarity(embedding, entry["embedding"])
+        if score > best_score:
+            best_score, best_content = score, entry["content"]
+    return best_score, best_content
+
+
+def _cosine_similarity(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
@@ -0,0 +1,64 @@
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.database import upsert
+from app.database.models import User, Property
+
+
+# Property columns filled in from platform search results
+LISTING_COLUMNS = (
+    "external_id", "platform", "title", "description", "price", "bedrooms", "bathrooms",
+    "property_type", "location", "postcode", "latitude", "longitude", "images", "features",
+    "agent_info", "url"
+)
+
+
+async def get_user_id(db: AsyncSession, session_id: str) -> Optional[int]:
+    """ID of the user for a session, or None; reads only the session_id index"""
+    result = await db.execute(select(User.id).where(User.session_id == session_id))
+    return result.scalar_one_or_none()
+
+
+async def get_or_create_user_id(db: AsyncSession, session_id: str) -> int:
+    """ID of the user for a session, creating the user if needed"""
+    user_id = await get_user_id(db, session_id)
+    if user_id is None:
+        user = User(session_id=session_id)
+        db.add(user)
+        await db.commit()
+        user_id = user.id
+    return user_id
+
+
+async def bulk_upsert_properties(
+    db: AsyncSession,
+    listings: List[Dict[str, Any]]
+) -> Dict[Tuple[str, str], int]:
+    """
+    Insert platform listings, or refresh the ones already stored, in a single
+    statement. Returns property IDs keyed by (platform, external_id); listings
+    without an external ID are skipped. The caller commits.
+    """
+    # One row per listing; a statement can't update the same row twice
+    rows = {
+        (listing["platform"], listing["external_id"]): {
+            column: listing.get(column) for column in LISTING_COLUMNS
+        }
+        for listing in listings
+        if listing.get("external_id")
+    }
+    if not rows:
+        return {}
+    
+    stmt = upsert(Property).values(list(rows.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Property.external_id, Property.platform],
+        set_={
+            **{column: stmt.excluded[column] for column in LISTING_COLUMNS[2:]},
+            "updated_at": func.now()
+        }
+    ).returning(Property.platform, Property.external_id, Property.id)
+    
+    result = await db.execute(stmt)
+    return {(platform, external_id): property_id for platform, external_id, property_id in result.all()}
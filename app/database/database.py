@@ -1,26 +1,125 @@
-from sqlalchemy import create_engine
+import orjson
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 from app.core.config import get_settings
 
 settings = get_settings()
 
-# Create database engine
-engine = create_engine(
-    settings.database_url,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.database_url else {}
+# Async drivers for the database URLs we support
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def get_async_database_url(database_url: str) -> str:
+    """Map a sync database URL onto the matching async driver"""
+    url = make_url(database_url)
+    drivername = ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)
+    return url.set(drivername=drivername).render_as_string(hide_password=False)
+
+
+def json_serializer(value) -> str:
+    """Encode JSON columns with orjson rather than the stdlib json module"""
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+def get_engine_options(database_url: str) -> dict:
+    """Pooling and JSON column options for an engine on the given database URL"""
+    url = make_url(database_url)
+    json_options = {"json_serializer": json_serializer, "json_deserializer": orjson.loads}
+    if url.get_backend_name() == "sqlite":
+        # File databases use SQLAlchemy's default SQLite pooling; an
+        # in-memory database must stay on one connection to persist
+        options = {"connect_args": {"check_same_thread": False}, **json_options}
+        if url.database in (None, "", ":memory:"):
+            options["poolclass"] = StaticPool
+        return options
+    
+    return {
+        **json_options,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
+
+# Sync engine, used for creating the schema
+engine = create_engine(settings.database_url, **get_engine_options(settings.database_url))
+
+# Async engine used by the application, so queries don't block the event loop
+async_engine = create_async_engine(
+    get_async_database_url(settings.database_url),
+    **get_engine_options(settings.database_url)
+)
+
+# Set on every new SQLite connection. SQLite only enforces foreign keys (and
+# their ON DELETE CASCADE) when asked. WAL lets readers carry on while a write
+# commits, and with it synchronous=NORMAL only syncs at checkpoints rather
+# than on every commit
+SQLITE_PRAGMAS = (
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",  # 256 MiB
+    "PRAGMA cache_size=-65536",  # 64 MiB
 )
 
+if make_url(settings.database_url).get_backend_name() == "sqlite":
+    @event.listens_for(engine, "connect")
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def _configure_sqlite_connection(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+def upsert(model):
+    """
+    An INSERT for the configured backend that supports ON CONFLICT, via
+    `on_conflict_do_update()` / `on_conflict_do_nothing()`
+    """
+    if make_url(settings.database_url).get_backend_name() == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
 # Create session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
 
 # Create base class for models
 Base = declarative_base()
 
+def init_db():
+    """
+    Create any missing tables and indexes. Run once before serving, and
+    again after upgrading (`python run.py --init-db`), rather than on every
+    import of the app
+    """
+    import app.database.models  # registers the models on Base
+    Base.metadata.create_all(bind=engine)
+    
+    # create_all skips tables that already exist, so add any indexes they're
+    # missing; the upserts rely on the unique ones as ON CONFLICT targets
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except Exception as e:
+                raise RuntimeError(
+                    f"Could not create index {index.name} on {table.name}; "
+                    f"remove duplicate rows or recreate the database: {e}"
+                ) from e
+
 # Dependency to get database session
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close() 
\ No newline at end of file
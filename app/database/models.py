@@ -1,8 +1,13 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Boolean, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Boolean, ForeignKey, JSON, Index
 from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql import func
 from app.database.database import Base
 
+# JSON documents are stored as JSONB on Postgres, so they're kept parsed and
+# can be GIN indexed; other databases use their plain JSON type
+JSONDocument = JSON().with_variant(JSONB(), "postgresql")
+
 
 class User(Base):
     __tablename__ = "users"
@@ -12,30 +17,39 @@ class User(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
-    # Relationships
-    conversations = relationship("Conversation", back_populates="user")
-    preferences = relationship("UserPreference", back_populates="user")
+    # Relationships; the database deletes a user's rows along with the user
+    conversations = relationship(
+        "Conversation", back_populates="user", cascade="all, delete-orphan", passive_deletes=True
+    )
+    preferences = relationship(
+        "UserPreference", back_populates="user", cascade="all, delete-orphan", passive_deletes=True
+    )
 
 
 class Conversation(Base):
     __tablename__ = "conversations"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     message = Column(Text, nullable=False)
     response = Column(Text, nullable=False)
-    message_type = Column(String)  # 'user', 'agent', 'system'
+    message_type = Column(String)  # 'agent' rows hold a whole exchange; older databases also have 'user' rows
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
     user = relationship("User", back_populates="conversations")
+    
+    # Recent history for a user is read newest-first
+    __table_args__ = (
+        Index("ix_conv_user_created", user_id, created_at.desc()),
+    )
 
 
 class UserPreference(Base):
     __tablename__ = "user_preferences"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     preference_type = Column(String, nullable=False)  # 'location', 'price', 'bedrooms', etc.
     preference_value = Column(String, nullable=False)
     confidence_score = Column(Float, default=1.0)
@@ -45,48 +59,70 @@ class UserPreference(Base):
     
     # Relationships
     user = relationship("User", back_populates="preferences")
+    
+    # One preference of each type per user, looked up by type when merging
+    __table_args__ = (
+        Index("ix_userpref_user_type", user_id, preference_type, unique=True),
+    )
 
 
 class Property(Base):
     __tablename__ = "properties"
     
     id = Column(Integer, primary_key=True, index=True)
-    external_id = Column(String, unique=True, index=True)  # ID from Zoopla/Rightmove
-    platform = Column(String, nullable=False)  # 'zoopla', 'rightmove'
+    external_id = Column(String)  # ID from Zoopla/Rightmove, unique per platform
+    platform = Column(String(16), nullable=False)  # 'zoopla', 'rightmove'
     title = Column(String, nullable=False)
     description = Column(Text)
     price = Column(Integer)
     bedrooms = Column(Integer)
     bathrooms = Column(Integer)
-    property_type = Column(String)  # 'house', 'flat', 'studio', etc.
+    property_type = Column(String(32))  # 'house', 'flat', 'studio', etc.
     location = Column(String, nullable=False)
-    postcode = Column(String)
+    postcode = Column(String(8))  # Full UK postcode ("SW1A 1AA") or just the outcode
     latitude = Column(Float)
     longitude = Column(Float)
-    images = Column(JSON)  # Array of image URLs
-    features = Column(JSON)  # Array of property features
-    agent_info = Column(JSON)  # Estate agent contact details
+    images = Column(JSONDocument)  # Array of image URLs
+    features = Column(JSONDocument)  # Array of property features
+    agent_info = Column(JSONDocument)  # Estate agent contact details
     url = Column(String)  # Link to original listing
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     # Relationships
     recommendations = relationship("PropertyRecommendation", back_populates="property")
+    
+    # Listing IDs are only unique within a platform. Many listings come without
+    # a postcode, so the postcode index leaves those out. The GIN index serves
+    # feature containment filters (features @> '["Garden"]') on Postgres only
+    __table_args__ = (
+        Index("ix_prop_ext_platform", external_id, platform, unique=True),
+        Index(
+            "ix_prop_postcode", postcode,
+            postgresql_where=postcode != "", sqlite_where=postcode != ""
+        ),
+        Index("ix_prop_features_gin", features, postgresql_using="gin").ddl_if(dialect="postgresql"),
+    )
 
 
 class PropertyRecommendation(Base):
     __tablename__ = "property_recommendations"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     property_id = Column(Integer, ForeignKey("properties.id"))
     relevance_score = Column(Float, nullable=False)
     reasoning = Column(Text)  # AI explanation for why this property was recommended
-    pros = Column(JSON)  # Array of pros based on user preferences
-    cons = Column(JSON)  # Array of cons based on user preferences
+    pros = Column(JSONDocument)  # Array of pros based on user preferences
+    cons = Column(JSONDocument)  # Array of cons based on user preferences
     viewed = Column(Boolean, default=False)
     user_feedback = Column(String)  # 'interested', 'not_interested', 'viewed'
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relationships
-    property = relationship("Property", back_populates="recommendations") 
\ No newline at end of file
+    property = relationship("Property", back_populates="recommendations")
+    
+    # A user's recommendations are read best-first
+    __table_args__ = (
+        Index("ix_rec_user_score", user_id, relevance_score.desc()),
+    ) 
\ No newline at end of file
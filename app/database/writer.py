@@ -0,0 +1,123 @@
+from typing import Iterable, List, Dict, Any, Optional
+import asyncio
+from sqlalchemy import insert
+
+from app.core.cache import invalidate, HISTORY_CACHE_KEY
+from app.database.database import AsyncSessionLocal
+from app.database.crud import bulk_upsert_properties
+from app.database.models import Conversation
+
+
+class ConversationWriter:
+    """
+    Persists conversation rows, and the listings found during those turns,
+    from a background task so a chat turn can return without waiting on the
+    database commit.
+    
+    Rows queued while the worker is not running (e.g. outside the app
+    lifespan) are written inline instead.
+    """
+    
+    def __init__(self):
+        self.queue: Optional[asyncio.Queue] = None
+        self.worker: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the background worker on the running event loop"""
+        if self.worker is None:
+            self.queue = asyncio.Queue()
+            self.worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush any queued rows, then stop the worker"""
+        if self.worker is None:
+            return
+        await self.queue.join()
+        self.worker.cancel()
+        self.worker = None
+        self.queue = None
+
+    async def write(
+        self,
+        rows: List[Dict[str, Any]],
+        cache_keys: Iterable[str] = (),
+        listings: Iterable[Dict[str, Any]] = ()
+    ):
+        """
+        Queue conversation rows for writing. `cache_keys` are invalidated
+        once the rows are committed, along with the users' cached histories.
+        `listings` are platform search results to upsert into properties.
+        """
+        if self.worker is None:
+            await self._write_batch([(rows, cache_keys, listings)])
+        else:
+            self.queue.put_nowait((rows, cache_keys, listings))
+
+    async def _run(self):
+        """Write queued rows, grouping whatever has piled up into one commit"""
+        while True:
+            batches = [await self.queue.get()]
+            while not self.queue.empty():
+                batches.append(self.queue.get_nowait())
+            
+            try:
+                await self._write_batch(batches)
+            except Exception as e:
+                # Retry one turn at a time so a bad row (e.g. for a user
+                # deleted meanwhile) doesn't lose the other turns
+                print(f"Error writing conversations, retrying individually: {e}")
+                for batch in batches:
+                    try:
+                        await self._write_batch([batch])
+                    except Exception as e:
+                        print(f"Error writing conversations: {e}")
+            finally:
+                for _ in batches:
+                    self.queue.task_done()
+
+    async def _write_batch(self, batches: List[tuple]):
+        """
+        Insert the batches' rows in a single commit and drop stale cache
+        entries, then upsert their listings in one statement
+        """
+        rows = [row for batch_rows, _, _ in batches for row in batch_rows]
+        if rows:
+            async with AsyncSessionLocal() as db:
+                await db.execute(insert(Conversation), rows)
+                await db.commit()
+            
+            cache_keys = {HISTORY_CACHE_KEY.format(user_id=row["user_id"]) for row in rows}
+            for _, batch_keys, _ in batches:
+                cache_keys.update(batch_keys)
+            await invalidate(*cache_keys)
+        
+        # Listings are only a convenience copy, so they go in their own
+        # transaction where a failure can't cost the conversation rows
+        listings = [listing for _, _, batch_listings in batches for listing in batch_listings]
+        if not listings:
+            return
+        try:
+            await self._upsert_listings(listings)
+        except Exception as e:
+            # As with conversations, retry turn by turn so one bad listing
+            # doesn't drop the others
+            print(f"Error storing properties, retrying individually: {e}")
+            for _, _, batch_listings in batches:
+                try:
+                    await self._upsert_listings(batch_listings)
+                except Exception as e:
+                    print(f"Error storing properties: {e}")
+
+    async def _upsert_listings(self, listings: Iterable[Dict[str, Any]]):
+        """Upsert platform listings into properties in a single commit"""
+        listings = list(listings)
+        if not listings:
+            return
+        
+        async with AsyncSessionLocal() as db:
+            await bulk_upsert_properties(db, listings)
+            await db.commit()
+
+
+# Shared writer, started and stopped with the application
+conversation_writer = ConversationWriter()
@@ -1,13 +1,130 @@
 from typing import List, Dict, Any, Optional
+from functools import lru_cache
 import asyncio
 import aiohttp
-import requests
-from bs4 import BeautifulSoup
-import json
-import time
+import lxml.html
+from lxml import etree
+import hashlib
+import heapq
+import orjson
+import re
 from urllib.parse import urlencode
 
 from app.core.config import get_settings
+from app.core.cache import redis_cached
+
+
+def _class_xpath(tag: str, class_name: str) -> str:
+    """XPath for descendant `tag` elements that have `class_name` among their classes"""
+    return f".//{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')]"
+
+
+@lru_cache(maxsize=None)
+def _compiled_class_xpath(tag: str, class_name: str) -> etree.XPath:
+    """`_class_xpath` compiled once, rather than on every card it's evaluated against"""
+    return etree.XPath(_class_xpath(tag, class_name))
+
+
+# Patterns for pulling details out of listing text
+BEDROOMS_PATTERN = re.compile(r'(\d+)\s*bed', re.IGNORECASE)
+POSTCODE_PATTERN = re.compile(r'[A-Z]{1,2}[0-9R][0-9A-Z]? [0-9][A-Z]{2}')  # UK postcode
+
+# Rightmove shows this many results per page, paged with the `index` parameter
+RIGHTMOVE_PAGE_SIZE = 24
+
+# Results taken from each Rightmove page, and the size of the chunks the
+# page is parsed in as it downloads
+RIGHTMOVE_MAX_RESULTS = 10
+RIGHTMOVE_CHUNK_SIZE = 16384
+
+# Rightmove location identifiers for the places we know; anything else searches London
+RIGHTMOVE_LOCATION_IDENTIFIERS = {
+    'london': 'REGION^876',
+    'manchester': 'REGION^775',
+    'birmingham': 'REGION^774'
+}
+RIGHTMOVE_DEFAULT_LOCATION = 'REGION^876'
+
+# Every byte except the ASCII digits, for deleting with bytes.translate
+NON_DIGIT_BYTES = bytes(i for i in range(256) if i not in b'0123456789')
+
+# Feature keywords looked for in descriptions, with the label each one adds
+ZOOPLA_FEATURE_KEYWORDS = tuple(
+    (keyword, keyword.title())
+    for keyword in ('garden', 'parking', 'garage', 'balcony', 'terrace', 'ensuite')
+)
+RIGHTMOVE_FEATURE_KEYWORDS = ZOOPLA_FEATURE_KEYWORDS + tuple(
+    (keyword, keyword.title())
+    for keyword in ('modern', 'victorian', 'new build')
+)
+
+
+# Search results are shared between users with the same criteria
+SEARCH_CACHE_TTL = 900
+
+# Criteria are normalized before searching, so near-identical requests share
+# one cached result: prices are bucketed to this step and bedrooms clamped
+SEARCH_PRICE_STEP = 5000
+SEARCH_MAX_BEDROOMS = 10
+PROPERTY_TYPE_ALIASES = {'apartment': 'flat', 'flats': 'flat', 'houses': 'house'}
+
+
+def create_http_session() -> aiohttp.ClientSession:
+    """
+    HTTP session shared by the platform clients, so connections (and their
+    TLS handshakes) are reused across searches. Call from the running loop.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=100, limit_per_host=20, ttl_dns_cache=300, keepalive_timeout=75
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=10))
+
+
+def _as_int(value: Any) -> Optional[int]:
+    """A number from an int, float or numeric string like "£500,000"; None otherwise"""
+    if isinstance(value, str):
+        value = value.replace(',', '').replace('£', '').strip()
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_search_criteria(criteria: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Canonical form of search criteria. Location and property type are
+    lowercased, prices bucketed to SEARCH_PRICE_STEP (widening the range,
+    so min rounds down and max rounds up) and bedrooms clamped. Values that
+    can't be interpreted are passed through unchanged.
+    """
+    normalized = dict(criteria)
+    
+    for field in ('location', 'property_type'):
+        if isinstance(normalized.get(field), str):
+            normalized[field] = normalized[field].strip().lower()
+    if 'property_type' in normalized:
+        normalized['property_type'] = PROPERTY_TYPE_ALIASES.get(
+            normalized['property_type'], normalized['property_type']
+        )
+    
+    for field, round_up in (('min_price', False), ('max_price', True)):
+        price = _as_int(normalized.get(field))
+        if price is not None:
+            buckets = -(-price // SEARCH_PRICE_STEP) if round_up else price // SEARCH_PRICE_STEP
+            normalized[field] = buckets * SEARCH_PRICE_STEP
+    
+    for field in ('min_bedrooms', 'max_bedrooms'):
+        bedrooms = _as_int(normalized.get(field))
+        if bedrooms is not None:
+            normalized[field] = min(max(bedrooms, 0), SEARCH_MAX_BEDROOMS)
+    
+    return normalized
+
+
+def search_cache_key(criteria: Dict[str, Any], **kwargs) -> str:
+    """Cache key for a search, independent of criteria ordering"""
+    canonical = orjson.dumps(criteria, option=orjson.OPT_SORT_KEYS, default=str)
+    return f"search:{hashlib.blake2b(canonical, digest_size=16).hexdigest()}"
 
 
 class PropertyPlatformManager:
@@ -15,62 +132,69 @@ class PropertyPlatformManager:
     Manages integrations with multiple property platforms to fetch real-time listings.
     """
     
-    def __init__(self):
+    def __init__(self, session: aiohttp.ClientSession):
         self.settings = get_settings()
-        self.zoopla_client = ZooplaClient(self.settings.zoopla_api_key)
-        self.rightmove_client = RightmoveClient()
+        self.session = session
+        self.zoopla_client = ZooplaClient(self.settings.zoopla_api_key, session)
+        self.rightmove_client = RightmoveClient(session)
+        
+        # Platforms searched for every query; Zoopla needs an API key
+        self.platforms = [self.rightmove_client]
+        if self.settings.zoopla_api_key:
+            self.platforms.insert(0, self.zoopla_client)
+    
+    async def aclose(self):
+        """Close the shared HTTP session"""
+        await self.session.close()
     
     async def search_properties(self, criteria: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
         Search properties across all platforms and return combined results.
+        Criteria are normalized first, so equivalent searches share a cache entry.
         """
-        tasks = []
-        
-        # Search Zoopla
-        if self.settings.zoopla_api_key:
-            tasks.append(self.zoopla_client.search_properties(criteria))
-        
-        # Search Rightmove (via scraping)
-        tasks.append(self.rightmove_client.search_properties(criteria))
-        
-        # Execute searches in parallel
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        return await self._search_platforms(normalize_search_criteria(criteria))
+    
+    @redis_cached(key=search_cache_key, ttl=SEARCH_CACHE_TTL, cache_empty=False)
+    async def _search_platforms(self, criteria: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Search every platform with normalized criteria; cached for a few minutes"""
+        # Query every platform at once, so a search takes as long as the
+        # slowest platform rather than the sum of them
+        results = await asyncio.gather(
+            *(platform.search_properties(criteria) for platform in self.platforms),
+            return_exceptions=True
+        )
         
-        # Combine and deduplicate results
+        # Combine results, skipping platforms that failed
         all_properties = []
-        for result in results:
-            if isinstance(result, list):
+        for platform, result in zip(self.platforms, results):
+            if isinstance(result, BaseException):
+                print(f"Error searching {type(platform).__name__}: {result}")
+            else:
                 all_properties.extend(result)
         
         # Remove duplicates based on address and price
         unique_properties = self._deduplicate_properties(all_properties)
         
-        # Sort by relevance score if available, otherwise by price
-        unique_properties.sort(
-            key=lambda x: (x.get('relevance_score', 0), -x.get('price', 0)), 
-            reverse=True
+        # Top 20 by relevance score if available, otherwise by price; only the
+        # results returned are ordered, rather than sorting them all
+        return heapq.nlargest(
+            20,
+            unique_properties,
+            key=lambda x: (x.get('relevance_score', 0), -x.get('price', 0))
         )
-        
-        return unique_properties[:20]  # Return top 20 results
     
     def _deduplicate_properties(self, properties: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Remove duplicate properties based on location and price"""
-        seen = set()
-        unique = []
-        
+        # Keyed on location, price and bedrooms; setdefault keeps the first
+        # property per key with a single hash lookup, and the dict keeps order
+        unique = {}
         for prop in properties:
-            # Create a key based on location and price for deduplication
-            key = (
-                prop.get('location', '').lower().strip(),
-                prop.get('price', 0),
-                prop.get('bedrooms', 0)
+            unique.setdefault(
+                (prop.get('location', '').lower().strip(), prop.get('price', 0), prop.get('bedrooms', 0)),
+                prop
             )
-            
-            if key not in seen:
-                seen.add(key)
-                unique.append(prop)
         
-        return unique
+        return list(unique.values())
 
 
 class ZooplaClient:
@@ -78,10 +202,10 @@ class ZooplaClient:
     Zoopla API client for fetching property listings.
     """
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, session: aiohttp.ClientSession):
         self.api_key = api_key
         self.base_url = "https://api.zoopla.co.uk/api/v1"
-        self.session = None
+        self.session = session
     
     async def search_properties(self, criteria: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Search properties using Zoopla API"""
@@ -91,15 +215,15 @@ class ZooplaClient:
         try:
             params = self._build_zoopla_params(criteria)
             
-            async with aiohttp.ClientSession() as session:
-                url = f"{self.base_url}/property_listings.json"
-                async with session.get(url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return self._parse_zoopla_results(data)
-                    else:
-                        print(f"Zoopla API error: {response.status}")
-                        return []
+            url = f"{self.base_url}/property_listings.json"
+            async with self.session.get(url, params=params) as response:
+                if response.status == 200:
+                    # orjson parses the listings much faster than aiohttp's stdlib json
+                    data = orjson.loads(await response.read())
+                    return self._parse_zoopla_results(data)
+                else:
+                    print(f"Zoopla API error: {response.status}")
+                    return []
         
         except Exception as e:
             print(f"Zoopla search error: {e}")
@@ -194,11 +318,7 @@ class ZooplaClient:
         
         # Add descriptive features from description
         description = listing.get('description', '').lower()
-        feature_keywords = ['garden', 'parking', 'garage', 'balcony', 'terrace', 'ensuite']
-        
-        for keyword in feature_keywords:
-            if keyword in description:
-                features.append(keyword.title())
+        features.extend(label for keyword, label in ZOOPLA_FEATURE_KEYWORDS if keyword in description)
         
         return features
 
@@ -208,38 +328,70 @@ class RightmoveClient:
     Rightmove client using web scraping (since they don't have a public API).
     """
     
-    def __init__(self):
+    def __init__(self, session: aiohttp.ClientSession):
+        self.settings = get_settings()
+        self.session = session
         self.base_url = "https://www.rightmove.co.uk"
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
+        # Shared by all searches, so concurrent users can't get us rate limited
+        self.request_semaphore = asyncio.Semaphore(self.settings.rightmove_max_concurrent_requests)
     
     async def search_properties(self, criteria: Dict[str, Any]) -> List[Dict[str, Any]]:
-        """Search properties on Rightmove using web scraping"""
+        """Search properties on Rightmove using web scraping, fetching result pages concurrently"""
+        pages = await asyncio.gather(*(
+            self._search_page(criteria, page * RIGHTMOVE_PAGE_SIZE)
+            for page in range(self.settings.rightmove_search_pages)
+        ))
+        return [prop for page in pages for prop in page]
+    
+    async def _search_page(self, criteria: Dict[str, Any], index: int) -> List[Dict[str, Any]]:
+        """Fetch one page of Rightmove search results, parsing it as it arrives"""
         try:
-            search_url = self._build_rightmove_url(criteria)
+            search_url = self._build_rightmove_url(criteria, index)
+            properties = []
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(search_url, headers=self.headers) as response:
-                    if response.status == 200:
-                        html = await response.text()
-                        return self._parse_rightmove_results(html)
-                    else:
+            async with self.request_semaphore:
+                async with self.session.get(search_url, headers=self.headers) as response:
+                    if response.status != 200:
                         print(f"Rightmove request failed: {response.status}")
                         return []
+                    
+                    # Feed the page to the parser chunk by chunk rather than
+                    # buffering all of it, and stop parsing once we have enough cards
+                    parser = self._create_card_parser(response.charset)
+                    async for chunk in response.content.iter_chunked(RIGHTMOVE_CHUNK_SIZE):
+                        parser.feed(chunk)
+                        properties.extend(self._read_property_cards(parser))
+                        if len(properties) >= RIGHTMOVE_MAX_RESULTS:
+                            break
+                    else:
+                        parser.close()
+                        properties.extend(self._read_property_cards(parser))
+                    
+                    # Read (and discard) the rest of the page, so the connection
+                    # goes back to the session's pool instead of being closed
+                    async for _ in response.content.iter_chunked(RIGHTMOVE_CHUNK_SIZE):
+                        pass
+            
+            return properties[:RIGHTMOVE_MAX_RESULTS]
         
         except Exception as e:
             print(f"Rightmove search error: {e}")
             return []
     
-    def _build_rightmove_url(self, criteria: Dict[str, Any]) -> str:
-        """Build Rightmove search URL from criteria"""
+    def _build_rightmove_url(self, criteria: Dict[str, Any], index: int = 0) -> str:
+        """Build Rightmove search URL from criteria, starting at result `index`"""
         params = {
             'searchType': 'SALE',
             'locationIdentifier': self._get_location_identifier(criteria.get('location', 'London')),
             'includeSSTC': 'false'
         }
         
+        if index:
+            params['index'] = str(index)
+        
         if 'max_price' in criteria:
             params['maxPrice'] = str(criteria['max_price'])
         
@@ -265,44 +417,45 @@ class RightmoveClient:
         query_string = urlencode(params)
         return f"{self.base_url}/property-for-sale/find.html?{query_string}"
     
-    def _get_location_identifier(self, location: str) -> str:
-        """Get Rightmove location identifier (simplified)"""
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def _get_location_identifier(location: str) -> str:
+        """Get Rightmove location identifier (simplified), memoized per location"""
         # This is a simplified version - in production, you'd need to call
         # Rightmove's location search API to get proper identifiers
-        location_mapping = {
-            'london': 'REGION^876',
-            'manchester': 'REGION^775',
-            'birmingham': 'REGION^774'
-        }
-        
         location_lower = location.lower()
-        for key, value in location_mapping.items():
+        for key, value in RIGHTMOVE_LOCATION_IDENTIFIERS.items():
             if key in location_lower:
                 return value
         
-        return 'REGION^876'  # Default to London
+        return RIGHTMOVE_DEFAULT_LOCATION
     
-    def _parse_rightmove_results(self, html: str) -> List[Dict[str, Any]]:
-        """Parse Rightmove HTML response"""
+    def _create_card_parser(self, encoding: Optional[str] = None) -> etree.HTMLPullParser:
+        """Incremental HTML parser reporting each completed div, as lxml.html elements"""
+        parser = etree.HTMLPullParser(events=('end',), tag='div', encoding=encoding)
+        parser.set_element_class_lookup(lxml.html.HtmlElementClassLookup())
+        return parser
+    
+    def _read_property_cards(self, parser: etree.HTMLPullParser) -> List[Dict[str, Any]]:
+        """Extract the property cards the parser has completed so far, then free them"""
         properties = []
         
-        try:
-            soup = BeautifulSoup(html, 'html.parser')
+        for _, element in parser.read_events():
+            if 'l-searchResult' not in element.get('class', '').split():
+                continue
             
-            # Find property cards
-            property_cards = soup.find_all('div', class_='l-searchResult')
+            try:
+                property_data = self._extract_property_from_card(element)
+                if property_data:
+                    properties.append(property_data)
+            except Exception as e:
+                print(f"Error parsing Rightmove property card: {e}")
             
-            for card in property_cards[:10]:  # Limit to 10 results
-                try:
-                    property_data = self._extract_property_from_card(card)
-                    if property_data:
-                        properties.append(property_data)
-                except Exception as e:
-                    print(f"Error parsing Rightmove property card: {e}")
-                    continue
-        
-        except Exception as e:
-            print(f"Error parsing Rightmove HTML: {e}")
+            # Drop the card, and anything parsed before it, so only the
+            # card being read is held in memory
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
         
         return properties
     
@@ -310,26 +463,27 @@ class RightmoveClient:
         """Extract property data from a Rightmove property card"""
         try:
             # Extract basic information
-            price_elem = card.find('span', class_='propertyCard-priceValue')
-            price = self._parse_price_text(price_elem.text if price_elem else '0')
+            price_elem = self._find(card, 'span', 'propertyCard-priceValue')
+            price = self._parse_price_text(price_elem.text_content() if price_elem is not None else '0')
             
-            address_elem = card.find('address', class_='propertyCard-address')
-            address = address_elem.text.strip() if address_elem else ''
+            address_elem = self._find(card, 'address', 'propertyCard-address')
+            address = address_elem.text_content().strip() if address_elem is not None else ''
             
-            description_elem = card.find('span', class_='propertyCard-description')
-            description = description_elem.text.strip() if description_elem else ''
+            description_elem = self._find(card, 'span', 'propertyCard-description')
+            description = description_elem.text_content().strip() if description_elem is not None else ''
+            description_lower = description.lower()
             
             # Extract property details
-            details = card.find('h2', class_='propertyCard-title')
-            bedrooms = self._extract_bedrooms(details.text if details else '')
+            details = self._find(card, 'h2', 'propertyCard-title')
+            bedrooms = self._extract_bedrooms(details.text_content() if details is not None else '')
             
             # Extract image
-            img_elem = card.find('img', class_='propertyCard-img')
-            image_url = img_elem.get('src', '') if img_elem else ''
+            img_elem = self._find(card, 'img', 'propertyCard-img')
+            image_url = img_elem.get('src', '') if img_elem is not None else ''
             
             # Extract property URL
-            link_elem = card.find('a', class_='propertyCard-link')
-            property_url = self.base_url + link_elem.get('href', '') if link_elem else ''
+            link_elem = self._find(card, 'a', 'propertyCard-link')
+            property_url = self.base_url + link_elem.get('href', '') if link_elem is not None else ''
             
             return {
                 'external_id': property_url.split('/')[-1] if property_url else '',
@@ -339,13 +493,13 @@ class RightmoveClient:
                 'price': price,
                 'bedrooms': bedrooms,
                 'bathrooms': 0,  # Not easily extractable from cards
-                'property_type': self._extract_property_type(description),
+                'property_type': self._extract_property_type(description_lower),
                 'location': address,
                 'postcode': self._extract_postcode(address),
                 'latitude': None,
                 'longitude': None,
                 'images': [image_url] if image_url else [],
-                'features': self._extract_features_from_description(description),
+                'features': self._extract_features_from_description(description_lower),
                 'agent_info': {},
                 'url': property_url,
                 'relevance_score': 0.7  # Default relevance for scraped results
@@ -355,24 +509,28 @@ class RightmoveClient:
             print(f"Error extracting property data: {e}")
             return None
     
+    def _find(self, card, tag: str, class_name: str):
+        """First `tag` element with `class_name` inside a card, or None"""
+        matches = _compiled_class_xpath(tag, class_name)(card)
+        return matches[0] if matches else None
+    
     def _parse_price_text(self, price_text: str) -> int:
         """Parse price text to integer"""
         try:
-            # Remove £, commas, and other characters
-            price_clean = ''.join(c for c in price_text if c.isdigit())
+            # Remove £, commas, and other characters in C: drop non-ASCII,
+            # then delete everything but the digits
+            price_clean = price_text.encode('ascii', 'ignore').translate(None, NON_DIGIT_BYTES)
             return int(price_clean) if price_clean else 0
         except:
             return 0
     
     def _extract_bedrooms(self, title_text: str) -> int:
         """Extract number of bedrooms from title"""
-        import re
-        match = re.search(r'(\d+)\s*bed', title_text.lower())
+        match = BEDROOMS_PATTERN.search(title_text)
         return int(match.group(1)) if match else 0
     
-    def _extract_property_type(self, description: str) -> str:
-        """Extract property type from description"""
-        description_lower = description.lower()
+    def _extract_property_type(self, description_lower: str) -> str:
+        """Extract property type from a lowercased description"""
         if 'flat' in description_lower or 'apartment' in description_lower:
             return 'flat'
         elif 'house' in description_lower:
@@ -384,21 +542,9 @@ class RightmoveClient:
     
     def _extract_postcode(self, address: str) -> str:
         """Extract postcode from address"""
-        import re
-        # UK postcode pattern
-        postcode_pattern = r'[A-Z]{1,2}[0-9R][0-9A-Z]? [0-9][A-Z]{2}'
-        match = re.search(postcode_pattern, address.upper())
+        match = POSTCODE_PATTERN.search(address.upper())
         return match.group(0) if match else ''
     
-    def _extract_features_from_description(self, description: str) -> List[str]:
-        """Extract features from property description"""
-        features = []
-        description_lower = description.lower()
-        
-        feature_keywords = ['garden', 'parking', 'garage', 'balcony', 'terrace', 'ensuite', 'modern', 'Victorian', 'new build']
-        
-        for keyword in feature_keywords:
-            if keyword in description_lower:
-                features.append(keyword.title())
-        
-        return features 
\ No newline at end of file
+    def _extract_features_from_description(self, description_lower: str) -> List[str]:
+        """Extract features from a lowercased property description"""
+        return [label for keyword, label in RIGHTMOVE_FEATURE_KEYWORDS if keyword in description_lower] 
\ No newline at end of file
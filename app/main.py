@@ -1,25 +1,38 @@
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import ORJSONResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 import os
 from dotenv import load_dotenv
 
 from app.core.config import get_settings
 from app.api import chat, properties, preferences
-from app.database.database import engine, Base
+from app.database.writer import conversation_writer
+from app.agents.core_agent import REAgent
+from app.integrations.property_platforms import PropertyPlatformManager, create_http_session
 
 # Load environment variables
 load_dotenv()
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the shared agent and run the background conversation writer"""
+    app.state.property_manager = PropertyPlatformManager(create_http_session())
+    app.state.agent = REAgent(app.state.property_manager)
+    conversation_writer.start()
+    yield
+    await conversation_writer.stop()
+    await app.state.property_manager.aclose()
 
 # Initialize FastAPI app
 app = FastAPI(
     title="REAgent - AI Real Estate Concierge",
     description="An intelligent, autonomous real estate assistant",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse  # orjson instead of stdlib json for API responses
 )
 
 # Settings
@@ -34,6 +47,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Unexpected errors become a generic 500; Starlette re-raises them afterwards
+# so the server still logs the traceback
+@app.exception_handler(Exception)
+async def unhandled_exception_handler(request: Request, exc: Exception):
+    return ORJSONResponse({"detail": "Internal server error"}, status_code=500)
+
 # Static files and templates
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
@@ -95,7 +95,7 @@ class REAgentApp {
         this.showTypingIndicator();
         
         try {
-            const response = await fetch('/api/chat/message', {
+            const response = await fetch('/api/chat/message/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -110,13 +110,50 @@ class REAgentApp {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
             
-            const data = await response.json();
+            // Read server-sent events, showing the response as it is generated
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let agentMessage = null;
+            let responseText = '';
+            let data = null;
+            
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                
+                buffer += decoder.decode(value, { stream: true });
+                const events = buffer.split('\n\n');
+                buffer = events.pop();
+                
+                for (const rawEvent of events) {
+                    if (!rawEvent.startsWith('data: ')) continue;
+                    const event = JSON.parse(rawEvent.slice(6));
+                    
+                    if (event.type === 'token') {
+                        if (!agentMessage) {
+                            document.getElementById('typingIndicator').style.display = 'none';
+                            agentMessage = this.addMessageToChat('', 'agent');
+                        }
+                        responseText += event.content;
+                        this.updateMessageText(agentMessage, responseText);
+                    } else {
+                        data = event;
+                    }
+                }
+            }
             
             // Hide typing indicator
             this.hideTypingIndicator();
             
-            // Add agent response to chat
-            this.addMessageToChat(data.response, 'agent');
+            if (!data) {
+                throw new Error('Response stream ended unexpectedly');
+            }
+            
+            // Add agent response to chat if nothing was streamed
+            if (!agentMessage) {
+                this.addMessageToChat(data.response, 'agent');
+            }
             
             // Update recommendations
             if (data.recommendations && data.recommendations.length > 0) {
@@ -167,6 +204,14 @@ class REAgentApp {
         if (sender === 'user' && document.querySelector('.welcome-message')) {
             document.querySelector('.welcome-message').remove();
         }
+        
+        return messageDiv;
+    }
+
+    updateMessageText(messageDiv, message) {
+        const chatMessages = document.getElementById('chatMessages');
+        messageDiv.querySelector('.message-text p').innerHTML = this.formatMessage(message);
+        chatMessages.scrollTop = chatMessages.scrollHeight;
     }
 
     formatMessage(message) {
@@ -480,12 +525,10 @@ class REAgentApp {
                     welcomeMessage.remove();
                 }
                 
+                // Each entry holds both sides of an exchange
                 data.conversations.forEach(conv => {
-                    if (conv.message_type === 'user') {
-                        this.addMessageToChat(conv.message, 'user');
-                    } else if (conv.message_type === 'agent') {
-                        this.addMessageToChat(conv.response, 'agent');
-                    }
+                    this.addMessageToChat(conv.message, 'user');
+                    this.addMessageToChat(conv.response, 'agent');
                 });
             }
             
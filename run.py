@@ -31,20 +31,35 @@ def main():
         print("🔗 Get your API key from: https://platform.openai.com/api-keys")
         return
     
+    # Create the database tables (only needed on first run or after adding models)
+    if "--init-db" in sys.argv:
+        from app.database.database import init_db
+        init_db()
+        print("🗄️  Database tables created")
+    
     print("🚀 Starting REAgent - AI Real Estate Concierge")
     print("🌐 Web interface will be available at: http://localhost:8000")
     print("📋 API documentation: http://localhost:8000/docs")
     print("💬 Ready to help you find your perfect home!")
     print("-" * 60)
     
-    # Run the application
+    # Run the application: auto-reload while developing; otherwise uvloop,
+    # httptools and a worker per two CPUs
+    if os.getenv("ENVIRONMENT", "development") == "development":
+        server_options = {"reload": True, "reload_dirs": ["app"]}
+    else:
+        server_options = {
+            "loop": "uvloop",
+            "http": "httptools",
+            "workers": max(1, (os.cpu_count() or 1) // 2),
+        }
+    
     uvicorn.run(
         "app.main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
-        reload_dirs=["app"],
-        log_level="info"
+        log_level="info",
+        **server_options
     )
 
 def create_env_template():
@@ -55,6 +70,9 @@ OPENAI_API_KEY=your_openai_api_key_here
 # Database Configuration
 DATABASE_URL=sqlite:///./reagent.db
 
+# Cache Configuration (Optional - leave empty to disable caching)
+REDIS_URL=
+
 # Property Platform APIs (Optional - will work without these)
 ZOOPLA_API_KEY=your_zoopla_api_key_here
 RIGHTMOVE_API_KEY=your_rightmove_api_key_here
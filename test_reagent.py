@@ -5,20 +5,32 @@ Simple test script for REAgent functionality
 
 import pytest
 import asyncio
+import inspect
 from fastapi.testclient import TestClient
 import os
 import sys
+import uuid
 from pathlib import Path
 
 # Add the app directory to Python path
 sys.path.insert(0, str(Path(__file__).parent))
 
-def test_health_check():
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    """Create the tables once for the whole test run"""
+    from app.database.database import init_db
+    init_db()
+
+@pytest.fixture(scope="session")
+def client():
+    """One TestClient for every test, so the app and its lifespan start once"""
+    from app.main import app
+    with TestClient(app) as client:
+        yield client
+
+def test_health_check(client):
     """Test that the application starts and health check works"""
     try:
-        from app.main import app
-        client = TestClient(app)
-        
         response = client.get("/health")
         assert response.status_code == 200
         assert response.json()["status"] == "healthy"
@@ -30,12 +42,9 @@ def test_health_check():
         print(f"❌ Health check failed: {e}")
         return False
 
-def test_web_interface():
+def test_web_interface(client):
     """Test that the web interface loads"""
     try:
-        from app.main import app
-        client = TestClient(app)
-        
         response = client.get("/")
         assert response.status_code == 200
         assert "REAgent" in response.text
@@ -47,12 +56,9 @@ def test_web_interface():
         print(f"❌ Web interface test failed: {e}")
         return False
 
-def test_api_endpoints():
+def test_api_endpoints(client):
     """Test that API endpoints are accessible"""
     try:
-        from app.main import app
-        client = TestClient(app)
-        
         # Test preferences endpoint
         response = client.get("/api/preferences/test_session")
         assert response.status_code == 200
@@ -95,6 +101,632 @@ def test_agent_imports():
         print(f"❌ Agent imports test failed: {e}")
         return False
 
+def test_history_paging(client):
+    """Test that conversation history pages back from the newest exchange"""
+    from datetime import datetime, timedelta
+    from sqlalchemy.orm import Session
+    from app.database.database import engine
+    from app.database.models import User, Conversation
+    
+    session_id = f"test_paging_{uuid.uuid4().hex}"
+    start = datetime(2024, 1, 1)
+    with Session(engine) as db:
+        user = User(session_id=session_id)
+        db.add(user)
+        db.flush()
+        # The middle two share a timestamp, so paging has to break ties on ID
+        conversations = [
+            Conversation(
+                user_id=user.id, message=f"message {i}", response=f"response {i}",
+                message_type="agent", created_at=start + timedelta(minutes=min(i, 3))
+            )
+            for i in range(5)
+        ]
+        db.add_all(conversations)
+        db.commit()
+        ids = [conv.id for conv in conversations]
+    
+    try:
+        url = f"/api/chat/history/{session_id}"
+        page = client.get(url, params={"limit": 2}).json()
+        assert [conv["id"] for conv in page["conversations"]] == ids[3:5]
+        assert page["next_cursor"] == ids[3]
+        
+        page = client.get(url, params={"limit": 2, "before": page["next_cursor"]}).json()
+        assert [conv["id"] for conv in page["conversations"]] == ids[1:3]
+        assert page["next_cursor"] == ids[1]
+        
+        page = client.get(url, params={"limit": 2, "before": page["next_cursor"]}).json()
+        assert [conv["id"] for conv in page["conversations"]] == ids[0:1]
+        assert page["next_cursor"] is None
+    finally:
+        with Session(engine) as db:
+            db.delete(db.query(User).filter_by(session_id=session_id).one())
+            db.commit()
+    
+    print("✅ Conversation history paging works")
+    return True
+
+def test_search_criteria_normalization():
+    """Test that equivalent search criteria normalize to the same cache key"""
+    from app.integrations.property_platforms import normalize_search_criteria, search_cache_key
+    
+    first = normalize_search_criteria({
+        "location": " London ", "max_price": "£499,999", "min_price": 101000,
+        "min_bedrooms": "2", "property_type": "Apartment"
+    })
+    assert first == {
+        "location": "london", "max_price": 500000, "min_price": 100000,
+        "min_bedrooms": 2, "property_type": "flat"
+    }
+    
+    second = normalize_search_criteria({
+        "property_type": "flat", "min_bedrooms": 2, "min_price": 100000,
+        "location": "london", "max_price": 500000
+    })
+    assert search_cache_key(first) == search_cache_key(second)
+    
+    # Bedrooms are clamped; values that aren't numbers pass through unchanged
+    assert normalize_search_criteria({"min_bedrooms": 40, "max_bedrooms": -1}) == {
+        "min_bedrooms": 10, "max_bedrooms": 0
+    }
+    assert normalize_search_criteria({"max_price": "500k"}) == {"max_price": "500k"}
+    
+    print("✅ Search criteria normalization works")
+    return True
+
+def test_location_pattern():
+    """Test that the fallback location pattern stops before the next clause"""
+    from app.agents.preference_learner import PreferenceLearner
+    
+    def location(message):
+        preferences = PreferenceLearner()._fallback_extraction(message)
+        return next((pref["value"] for pref in preferences if pref["type"] == "location"), None)
+    
+    assert location("2 bed flat in london under 500k") == "London"
+    assert location("a house in north leeds with a garden") == "North Leeds"
+    assert location("somewhere near camden and islington") == "Camden"
+    assert location("flats around bristol, max 300k") == "Bristol"
+    assert location("a flat in soho for a couple") == "Soho"
+    assert location("3 bed house please") is None
+    
+    print("✅ Location pattern works")
+    return True
+
+def test_bulk_upsert_deduplicates():
+    """Test that a batch listing the same property twice stores it once"""
+    from sqlalchemy import delete, select
+    from app.database.database import AsyncSessionLocal
+    from app.database.crud import bulk_upsert_properties
+    from app.database.models import Property
+    
+    external_id = f"test_{uuid.uuid4().hex}"
+    listing = {"external_id": external_id, "platform": "rightmove", "title": "Flat", "location": "London"}
+    
+    async def upsert_twice():
+        async with AsyncSessionLocal() as db:
+            try:
+                ids = await bulk_upsert_properties(db, [
+                    {**listing, "price": 400000},
+                    {**listing, "price": 450000},
+                    {**listing, "external_id": ""}  # skipped
+                ])
+                await db.commit()
+                prices = (await db.execute(
+                    select(Property.price).where(Property.external_id == external_id)
+                )).scalars().all()
+                return ids, prices
+            finally:
+                await db.execute(delete(Property).where(Property.external_id == external_id))
+                await db.commit()
+    
+    ids, prices = asyncio.run(upsert_twice())
+    assert list(ids) == [("rightmove", external_id)]
+    assert prices == [450000]  # the last listing in the batch wins
+    
+    print("✅ Bulk property upsert deduplicates")
+    return True
+
+def test_writer_upserts_listings():
+    """Test that the background writer stores a turn's listings without risking its conversation"""
+    from sqlalchemy import delete, select
+    from sqlalchemy.orm import Session
+    from app.database.database import AsyncSessionLocal, engine
+    from app.database.models import User, Conversation, Property
+    from app.database.writer import ConversationWriter
+    
+    session_id = f"test_writer_{uuid.uuid4().hex}"
+    external_id = f"test_{uuid.uuid4().hex}"
+    listing = {"external_id": external_id, "platform": "zoopla", "title": "House", "location": "York"}
+    with Session(engine) as db:
+        user = User(session_id=session_id)
+        db.add(user)
+        db.commit()
+        user_id = user.id
+    
+    def row(message):
+        return {"user_id": user_id, "message": message, "response": "ok", "message_type": "agent"}
+    
+    async def write_turns():
+        writer = ConversationWriter()
+        writer.start()
+        await writer.write([row("first")], listings=[{**listing, "price": 300000}])
+        await writer.write([row("second")], listings=[{**listing, "price": 310000}])
+        # A listing that can't be stored (no title) doesn't lose the exchange
+        await writer.write([row("third")], listings=[{**listing, "external_id": "bad", "title": None}])
+        await writer.stop()
+        
+        async with AsyncSessionLocal() as db:
+            messages = (await db.execute(
+                select(Conversation.message).where(Conversation.user_id == user_id).order_by(Conversation.id)
+            )).scalars().all()
+            prices = (await db.execute(
+                select(Property.price).where(Property.external_id == external_id)
+            )).scalars().all()
+            await db.execute(delete(Property).where(Property.external_id == external_id))
+            await db.commit()
+        return messages, prices
+    
+    try:
+        messages, prices = asyncio.run(write_turns())
+    finally:
+        with Session(engine) as db:
+            db.delete(db.query(User).filter_by(session_id=session_id).one())
+            db.commit()
+    
+    assert messages == ["first", "second", "third"]
+    assert prices == [310000]
+    
+    print("✅ Background writer upserts listings")
+    return True
+
+def test_preference_write_failure_keeps_turn():
+    """Test that a failed preference write doesn't fail extraction, on either path"""
+    from app.agents.preference_learner import PreferenceLearner
+    
+    class FailingLearner(PreferenceLearner):
+        async def _update_user_preferences_bulk(self, user_id, preferences):
+            raise RuntimeError("UNIQUE constraint failed")
+    
+    learner = FailingLearner()
+    learner.openai_client = None  # any LLM call fails
+    
+    # Short message with enough pattern matches: the fast path, no LLM call
+    preferences = asyncio.run(learner.extract_preferences("2 bed flat in leeds", 1))
+    assert {pref["type"] for pref in preferences} == {"location", "min_bedrooms", "property_type"}
+    
+    # A long message goes to the LLM, which fails, so the patterns are used
+    message = "We'd like a 3 bed house in york, somewhere quiet with a garden and space for the kids to play"
+    preferences = asyncio.run(learner.extract_preferences(message, 1))
+    assert {"location", "min_bedrooms", "property_type"} <= {pref["type"] for pref in preferences}
+    
+    print("✅ Preference write failures are contained")
+    return True
+
+def test_conversation_context_window():
+    """Test that only the configured number of recent exchanges are loaded as context"""
+    from sqlalchemy.orm import Session
+    from app.database.database import AsyncSessionLocal, engine
+    from app.database.models import User, Conversation
+    from app.agents.core_agent import REAgent
+    from app.core.config import get_settings
+    
+    session_id = f"test_context_{uuid.uuid4().hex}"
+    with Session(engine) as db:
+        user = User(session_id=session_id)
+        db.add(user)
+        db.flush()
+        db.add_all([
+            Conversation(user_id=user.id, message=f"message {i}", response=f"response {i}", message_type="agent")
+            for i in range(8)
+        ])
+        db.commit()
+        user_id = user.id
+    
+    async def load_history():
+        async with AsyncSessionLocal() as db:
+            return await REAgent(None)._get_conversation_history(db, user_id)
+    
+    try:
+        history = asyncio.run(load_history())
+    finally:
+        with Session(engine) as db:
+            db.delete(db.query(User).filter_by(session_id=session_id).one())
+            db.commit()
+    
+    exchanges = get_settings().max_conversation_history
+    assert len(history) == 2 * exchanges
+    assert history[0] == {"role": "user", "content": f"message {8 - exchanges}"}
+    assert history[-1] == {"role": "assistant", "content": "response 7"}
+    
+    print("✅ Conversation context is limited to recent exchanges")
+    return True
+
+def test_semantic_extraction_cache():
+    """Test the semantic tier's matching and that messages with numbers skip it"""
+    import orjson
+    from app.agents.preference_learner import PreferenceLearner
+    from app.core.llm import AsyncLLMCache, _best_match
+    
+    entries = [
+        orjson.dumps({"embedding": [1.0, 0.0], "content": "east"}),
+        orjson.dumps({"embedding": [0.6, 0.8], "content": "north-east"}),
+    ]
+    assert _best_match([0.0, 1.0], entries) == (0.8, "north-east")
+    assert _best_match([1.0, 0.0], []) == (0.0, None)
+    
+    class RecordingCache(AsyncLLMCache):
+        def __init__(self):
+            super().__init__()
+            self.embedded = []
+        async def get(self, key):
+            return None
+        async def embed(self, text):
+            self.embedded.append(text)
+            return None
+        async def get_similar(self, user_id, embedding):
+            return None
+    
+    learner = PreferenceLearner()
+    learner.llm_cache = RecordingCache()
+    learner.openai_client = None  # the LLM call fails, falling back to patterns
+    learner._store_preferences = lambda user_id, preferences: asyncio.sleep(0)
+    
+    with_numbers = "Looking for a 3 bed flat in london with a garden, close to the tube and good schools"
+    without_numbers = "Looking for a flat in london with a garden, close to the tube and good schools nearby"
+    asyncio.run(learner.extract_preferences(with_numbers, 1))
+    asyncio.run(learner.extract_preferences(without_numbers, 1))
+    assert learner.llm_cache.embedded == [without_numbers]
+    
+    print("✅ Semantic extraction cache works")
+    return True
+
+def test_chat_message_endpoint(client):
+    """Test that the message endpoint calls the shared agent and fills in a session ID"""
+    from app.api.dependencies import get_agent
+    
+    calls = []
+    
+    class StubAgent:
+        async def process_message(self, db, message, session_id):
+            calls.append((message, session_id))
+            return {
+                "response": "Hello", "recommendations": [],
+                "extracted_preferences": [], "conversation_id": 1
+            }
+    
+    client.app.dependency_overrides[get_agent] = StubAgent
+    try:
+        response = client.post("/api/chat/message", json={"message": "hi"})
+    finally:
+        client.app.dependency_overrides.clear()
+    
+    assert response.status_code == 200
+    session_id = response.json()["session_id"]
+    assert calls == [("hi", session_id)] and len(session_id) >= 16
+    
+    print("✅ Chat message endpoint works")
+    return True
+
+def test_save_property(client):
+    """Test that saving a listing twice keeps one row and that an external ID is required"""
+    from sqlalchemy import delete
+    from app.database.database import AsyncSessionLocal
+    from app.database.models import Property
+    
+    async def cleanup():
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(Property).where(Property.external_id == listing["external_id"]))
+            await db.commit()
+    
+    listing = {
+        "external_id": f"test_{uuid.uuid4().hex}", "platform": "zoopla",
+        "title": "2 bed flat", "location": "Camden", "price": 450000
+    }
+    try:
+        first = client.post("/api/properties/save", json=listing)
+        second = client.post("/api/properties/save", json=listing)
+        missing = client.post("/api/properties/save", json={**listing, "external_id": None})
+    finally:
+        asyncio.run(cleanup())
+    
+    assert first.status_code == 200 and first.json()["status"] == "saved"
+    assert second.json()["status"] == "exists"
+    assert second.json()["property_id"] == first.json()["property_id"]
+    assert missing.status_code == 422
+    
+    print("✅ Property save deduplicates")
+    return True
+
+
+def test_stream_message_endpoint(client):
+    """Test that the stream endpoint frames agent events as server-sent events"""
+    import orjson
+    from app.api.dependencies import get_agent
+    
+    class StubAgent:
+        async def stream_message(self, db, message, session_id):
+            yield {"type": "token", "content": "Hel"}
+            yield {"type": "token", "content": "lo"}
+            yield {"type": "done", "response": "Hello", "recommendations": []}
+    
+    client.app.dependency_overrides[get_agent] = StubAgent
+    try:
+        response = client.post("/api/chat/message/stream", json={"message": "hi", "session_id": "stream-test"})
+    finally:
+        client.app.dependency_overrides.clear()
+    
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    
+    frames = response.text.split("\n\n")
+    assert frames[-1] == ""  # every event ends with a blank line
+    assert all(frame.startswith("data: ") for frame in frames[:-1])
+    events = [orjson.loads(frame[len("data: "):]) for frame in frames[:-1]]
+    assert [event["type"] for event in events] == ["token", "token", "done"]
+    assert "".join(event.get("content", "") for event in events) == "Hello"
+    assert events[-1]["session_id"] == "stream-test"
+    
+    print("✅ Stream message endpoint works")
+    return True
+
+
+def test_writer_invalidates_cache():
+    """Test that the background writer drops stale cache entries once rows are committed"""
+    from sqlalchemy import select
+    from sqlalchemy.orm import Session
+    from app.core.cache import HISTORY_CACHE_KEY
+    from app.database import writer as writer_module
+    from app.database.database import AsyncSessionLocal, engine
+    from app.database.models import User, Conversation
+    
+    session_id = f"test_writer_{uuid.uuid4().hex}"
+    with Session(engine) as db:
+        user = User(session_id=session_id)
+        db.add(user)
+        db.commit()
+        user_id = user.id
+    
+    invalidated = []
+    
+    async def record_invalidate(*keys):
+        # Rows must already be committed when their cache entries are dropped
+        async with AsyncSessionLocal() as db:
+            count = len((await db.execute(
+                select(Conversation.id).where(Conversation.user_id == user_id)
+            )).scalars().all())
+        invalidated.append((set(keys), count))
+    
+    def row(message):
+        return {"user_id": user_id, "message": message, "response": "ok", "message_type": "agent"}
+    
+    async def write_turns():
+        # Not started: written inline
+        writer = writer_module.ConversationWriter()
+        await writer.write([row("first")], cache_keys=["response:a"])
+        # Started: turns queued together are written and invalidated together
+        writer.start()
+        await writer.write([row("second")], cache_keys=["response:b"])
+        await writer.write([row("third")], cache_keys=["response:c"])
+        await writer.stop()
+    
+    original_invalidate = writer_module.invalidate
+    writer_module.invalidate = record_invalidate
+    try:
+        asyncio.run(write_turns())
+    finally:
+        writer_module.invalidate = original_invalidate
+        with Session(engine) as db:
+            db.delete(db.query(User).filter_by(session_id=session_id).one())
+            db.commit()
+    
+    history_key = HISTORY_CACHE_KEY.format(user_id=user_id)
+    assert invalidated == [
+        ({history_key, "response:a"}, 1),
+        ({history_key, "response:b", "response:c"}, 3)
+    ]
+    
+    print("✅ Background writer invalidates cache")
+    return True
+
+
+def test_preference_insights(client):
+    """Test that preference insights are aggregated correctly in the database"""
+    from sqlalchemy.orm import Session
+    from app.database.database import engine
+    from app.database.models import User, UserPreference
+    
+    session_id = f"test_insights_{uuid.uuid4().hex}"
+    empty_session_id = f"test_insights_{uuid.uuid4().hex}"
+    with Session(engine) as db:
+        user = User(session_id=session_id)
+        user.preferences = [
+            UserPreference(preference_type="location", preference_value="London", confidence_score=0.9),
+            UserPreference(preference_type="max_price", preference_value="500000", confidence_score=0.8),
+            UserPreference(preference_type="min_bedrooms", preference_value="2", confidence_score=0.6, is_explicit=False),
+            UserPreference(preference_type="pets", preference_value="cat", confidence_score=0.3, is_explicit=False),
+        ]
+        db.add_all([user, User(session_id=empty_session_id)])
+        db.commit()
+    
+    try:
+        insights = client.get(f"/api/preferences/{session_id}/insights").json()
+        empty = client.get(f"/api/preferences/{empty_session_id}/insights").json()
+        missing = client.get(f"/api/preferences/test_insights_missing_{uuid.uuid4().hex}/insights")
+    finally:
+        with Session(engine) as db:
+            for user in db.query(User).filter(User.session_id.in_([session_id, empty_session_id])):
+                db.delete(user)
+            db.commit()
+    
+    assert insights["total_preferences"] == 4
+    assert insights["explicit_preferences"] == 2
+    assert insights["implicit_preferences"] == 2
+    assert insights["confidence_distribution"] == {"high": 2, "medium": 1, "low": 1}
+    assert insights["average_confidence"] == 0.65
+    assert insights["preference_categories"] == {
+        "Location": 1, "Financial": 1, "Property Specs": 1, "Other": 1
+    }
+    assert empty["total_preferences"] == 0
+    assert missing.status_code == 404
+    
+    print("✅ Preference insights work")
+    return True
+
+
+def test_clear_session_cascades(client):
+    """Test that clearing a session deletes the user's rows through ON DELETE CASCADE"""
+    from sqlalchemy import delete, func, insert, select
+    from sqlalchemy.orm import Session
+    from app.database.database import engine
+    from app.database.models import User, Conversation, UserPreference, Property, PropertyRecommendation
+    
+    session_id = f"test_clear_{uuid.uuid4().hex}"
+    external_id = f"test_{uuid.uuid4().hex}"
+    # Plain inserts, so only the database's cascade can remove the child rows
+    with Session(engine) as db:
+        user_id = db.execute(insert(User).values(session_id=session_id).returning(User.id)).scalar_one()
+        property_id = db.execute(insert(Property).values(
+            external_id=external_id, platform="zoopla", title="Flat", location="Leeds"
+        ).returning(Property.id)).scalar_one()
+        db.execute(insert(Conversation).values(user_id=user_id, message="hi", response="hello", message_type="agent"))
+        db.execute(insert(UserPreference).values(user_id=user_id, preference_type="location", preference_value="Leeds"))
+        db.execute(insert(PropertyRecommendation).values(user_id=user_id, property_id=property_id, relevance_score=0.9))
+        db.commit()
+    
+    try:
+        cleared = client.delete(f"/api/chat/session/{session_id}")
+        cleared_again = client.delete(f"/api/chat/session/{session_id}")
+        
+        with Session(engine) as db:
+            remaining = [
+                db.execute(select(func.count()).select_from(model).where(model.user_id == user_id)).scalar_one()
+                for model in (Conversation, UserPreference, PropertyRecommendation)
+            ]
+            user_left = db.get(User, user_id)
+    finally:
+        with Session(engine) as db:
+            db.execute(delete(User).where(User.session_id == session_id))
+            db.execute(delete(Property).where(Property.external_id == external_id))
+            db.commit()
+    
+    assert cleared.status_code == 200 and cleared.json()["status"] == "success"
+    assert cleared_again.status_code == 404
+    assert user_left is None
+    assert remaining == [0, 0, 0]
+    
+    print("✅ Clearing a session cascades")
+    return True
+
+
+def test_preference_update_upserts(client):
+    """Test that updating a preference twice overwrites a single row"""
+    from sqlalchemy.orm import Session
+    from app.database.database import engine
+    from app.database.models import User, UserPreference
+    
+    session_id = f"test_prefs_{uuid.uuid4().hex}"
+    url = f"/api/preferences/{session_id}/update"
+    try:
+        first = client.post(url, json={"preference_type": "location", "preference_value": "Leeds"})
+        second = client.post(url, json={
+            "preference_type": "location", "preference_value": "York",
+            "confidence_score": 0.7, "is_explicit": False
+        })
+        
+        with Session(engine) as db:
+            rows = [
+                (pref.preference_value, pref.confidence_score, pref.is_explicit, pref.updated_at is not None)
+                for pref in db.query(UserPreference).join(User).filter(User.session_id == session_id)
+            ]
+    finally:
+        with Session(engine) as db:
+            for user in db.query(User).filter_by(session_id=session_id):
+                db.delete(user)
+            db.commit()
+    
+    assert first.status_code == 200 and second.status_code == 200
+    # updated_at is only set by the conflict update
+    assert rows == [("York", 0.7, False, True)]
+    
+    print("✅ Preference update upserts")
+    return True
+
+
+def test_rightmove_pull_parser():
+    """Test that Rightmove pages are parsed incrementally and stop at the result limit"""
+    from app.integrations.property_platforms import RightmoveClient, RIGHTMOVE_MAX_RESULTS
+    
+    card = (
+        '<div class="l-searchResult is-list"><div class="propertyCard">'
+        '<a class="propertyCard-link" href="/properties/{n}"></a>'
+        '<h2 class="propertyCard-title">{n} bedroom flat for sale</h2>'
+        '<address class="propertyCard-address">{n} High Street, Leeds LS1 4AP</address>'
+        '<span class="propertyCard-description">Bright apartment with a garden</span>'
+        '<span class="propertyCard-priceValue">£{n}00,000</span>'
+        '</div></div>'
+    )
+    page = (
+        '<html><body><div id="results">'
+        + ''.join(card.format(n=n) for n in range(1, 13))
+        + '</div></body></html>'
+    ).encode('utf-8')
+    chunks = [page[i:i + 100] for i in range(0, len(page), 100)]
+    
+    class FakeContent:
+        def __init__(self):
+            self.remaining = iter(chunks)
+        
+        async def iter_chunked(self, size):
+            for chunk in self.remaining:
+                yield chunk
+    
+    class FakeResponse:
+        status = 200
+        charset = 'utf-8'
+        
+        def __init__(self):
+            self.content = FakeContent()
+        
+        async def __aenter__(self):
+            return self
+        
+        async def __aexit__(self, *exc):
+            return False
+    
+    class FakeSession:
+        def get(self, url, headers=None):
+            self.response = FakeResponse()
+            return self.response
+    
+    session = FakeSession()
+    client = RightmoveClient(session)
+    properties = asyncio.run(client._search_page({"location": "Leeds"}, 0))
+    
+    assert len(properties) == RIGHTMOVE_MAX_RESULTS
+    assert properties[0] == {
+        **properties[0],
+        'external_id': '1', 'platform': 'rightmove', 'price': 100000, 'bedrooms': 1,
+        'property_type': 'flat', 'postcode': 'LS1 4AP', 'features': ['Garden'],
+        'url': 'https://www.rightmove.co.uk/properties/1'
+    }
+    assert [prop['external_id'] for prop in properties] == [str(n) for n in range(1, 11)]
+    # The rest of the page is drained so the connection can be reused
+    assert next(session.response.content.remaining, None) is None
+    
+    # A page with fewer cards is parsed to the end
+    parser = client._create_card_parser('utf-8')
+    parser.feed(page[:len(page) // 2])
+    first_half = client._read_property_cards(parser)
+    assert 0 < len(first_half) < 12  # cards are reported as soon as they close
+    parser.feed(page[len(page) // 2:])
+    parser.close()
+    assert len(first_half) + len(client._read_property_cards(parser)) == 12
+    
+    print("✅ Rightmove pull parser works")
+    return True
+
+
 def run_basic_tests():
     """Run all basic tests"""
     print("🧪 Running REAgent Basic Tests")
@@ -106,18 +738,41 @@ def run_basic_tests():
         ("Health Check", test_health_check),
         ("Web Interface", test_web_interface),
         ("API Endpoints", test_api_endpoints),
+        ("History Paging", test_history_paging),
+        ("Search Criteria Normalization", test_search_criteria_normalization),
+        ("Location Pattern", test_location_pattern),
+        ("Bulk Upsert", test_bulk_upsert_deduplicates),
+        ("Writer Listings", test_writer_upserts_listings),
+        ("Preference Write Failure", test_preference_write_failure_keeps_turn),
+        ("Conversation Context", test_conversation_context_window),
+        ("Semantic Cache", test_semantic_extraction_cache),
+        ("Chat Message", test_chat_message_endpoint),
+        ("Save Property", test_save_property),
+        ("Stream Message", test_stream_message_endpoint),
+        ("Writer Cache Invalidation", test_writer_invalidates_cache),
+        ("Preference Insights", test_preference_insights),
+        ("Clear Session", test_clear_session_cascades),
+        ("Preference Update", test_preference_update_upserts),
+        ("Rightmove Parser", test_rightmove_pull_parser),
     ]
     
     passed = 0
     total = len(tests)
     
-    for test_name, test_func in tests:
-        print(f"\n🔍 Running {test_name} test...")
-        try:
-            if test_func():
-                passed += 1
-        except Exception as e:
-            print(f"❌ {test_name} test failed with exception: {e}")
+    from app.main import app
+    with TestClient(app) as client:
+        for test_name, test_func in tests:
+            print(f"\n🔍 Running {test_name} test...")
+            try:
+                # Tests that take the client share this one, as with the pytest fixture
+                if "client" in inspect.signature(test_func).parameters:
+                    result = test_func(client)
+                else:
+                    result = test_func()
+                if result:
+                    passed += 1
+            except Exception as e:
+                print(f"❌ {test_name} test failed with exception: {e}")
     
     print("\n" + "=" * 50)
     print(f"📊 Test Results: {passed}/{total} tests passed")